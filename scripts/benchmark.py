@@ -0,0 +1,311 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+from mallows import config
+from mallows.distribution import Mallows
+from mallows.eda import EDA
+from mallows.metrics import KendallTau
+from mallows.scheduler import Scheduler
+from mallows.selection import get_linear_ranking_selection, top_k_selection
+from mallows.telemetry import Telemetry
+from mallows.tsp_utils import (
+    get_objective_function,
+    get_tour_length,
+    get_tsp_problem,
+    read_tsp_file,
+)
+from mallows.utils import estimate_mean, estimate_theta
+
+# Two levels: micro-benchmarks of the hot kernels over (n, m) grids and
+# end-to-end EDA runs on local TSPLIB instances. Everything runs offline;
+# missing instances are skipped. Results are written as JSON and can be
+# compared against a stored baseline:
+#
+#   python scripts/benchmark.py run --output reports/benchmarks/baseline.json
+#   python scripts/benchmark.py run --output reports/benchmarks/latest.json
+#   python scripts/benchmark.py compare reports/benchmarks/baseline.json \
+#       reports/benchmarks/latest.json
+
+GRIDS = {
+    "quick": {"n": [14, 100], "m": [100, 1000]},
+    "full": {"n": [14, 100, 500], "m": [100, 1000, 10000]},
+}
+INSTANCES = ["burma14", "ulysses16", "ulysses22", "att48", "eil51", "berlin52"]
+GAPS = [0.1, 0.05, 0.01, 0.0]
+
+
+def timeit(function, repeat):
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": float(np.median(times)), "repeat": repeat}
+
+
+def random_distances(n, rng):
+    coords = rng.random((n, 2)) * 1000
+    return np.sqrt(((coords[:, None] - coords[None]) ** 2).sum(-1))
+
+
+def micro_benchmarks(grid, repeat, seed):
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in grid["n"]:
+        sigma_0 = rng.permutation(n)
+        distribution = Mallows(sigma_0, 0.5, None, rng)
+        objective_function = get_objective_function(random_distances(n + 1, rng))
+        kendall_tau = KendallTau(n)
+        linear_ranking_selection = get_linear_ranking_selection(0.5, 1.5)
+        for m in grid["m"]:
+            samples = distribution.sample_n(m)
+            objectives = rng.random(m)
+            kernels = {
+                "Mallows.sample_n": lambda: distribution.sample_n(m),
+                "estimate_mean": lambda: estimate_mean(samples),
+                "estimate_theta": lambda: estimate_theta(samples, sigma_0),
+                "KendallTau": lambda: kendall_tau(samples, sigma_0),
+                "TSPObjective": lambda: objective_function(samples, offset=1),
+                "top_k_selection": lambda: top_k_selection(objectives, m // 10),
+                "linear_ranking_selection": lambda: linear_ranking_selection(
+                    objectives, m // 10, rng
+                ),
+            }
+            for name, function in kernels.items():
+                results.append(
+                    {"name": name, "n": n, "m": m, **timeit(function, repeat)}
+                )
+                print(f"{name:<26} n={n:<5} m={m:<6} {results[-1]['median']:.2e} s")
+    return results
+
+
+def read_benchmarks(data_dir, instances, repeat):
+    results = []
+    for instance in instances:
+        filepath = f"{data_dir}/{instance}.tsp"
+        if not os.path.exists(filepath):
+            continue
+        timing = timeit(lambda: read_tsp_file(filepath), repeat)
+        results.append({"name": "read_tsp_file", "instance": instance, **timing})
+        print(f"{'read_tsp_file':<26} {instance:<14} {timing['median']:.2e} s")
+    return results
+
+
+def generations_to_gap(best, optimum):
+    # First generation whose best objective is within each relative gap
+    result = {}
+    for gap in GAPS:
+        reached = np.flatnonzero(best <= optimum * (1 + gap))
+        result[str(gap)] = int(reached[0]) if reached.size else None
+    return result
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def end_to_end_run(data_dir, instance, seed, time_budget):
+    # Runs in a fresh process, so the peak RSS belongs to this run only
+    coords, dist_matrix, objective_function, optimal_solution = get_tsp_problem(
+        data_dir, instance, use_cache=False
+    )
+    n = coords.shape[0]
+    optimum = None
+    if optimal_solution is not None:
+        optimum = float(get_tour_length(objective_function, optimal_solution))
+    telemetry = Telemetry()
+    eda = EDA(
+        n,
+        objective_function,
+        population_size=n * 100,
+        selection_size=n * 10,
+        offspring_size=n * 100 - 1,
+        n_iter=n * 100,
+        selection_function=top_k_selection,
+        restart_after_central_permutaition_fix=200,
+        rng=seed,
+        telemetry=telemetry,
+        scheduler=Scheduler(target=optimum, time_budget=time_budget),
+    )
+    start = time.perf_counter()
+    _, _, best_individual = eda.evolve(disable_tqdm=True, verbose=False)
+    wall_time = time.perf_counter() - start
+    best = float(objective_function(best_individual.reshape(1, -1) + 1)[0])
+    history = telemetry.history()
+    return {
+        "instance": instance,
+        "n": n,
+        "seed": seed,
+        "wall_time": wall_time,
+        "generations": telemetry.n_generations,
+        "stop_reason": eda.stop_reason,
+        "best": best,
+        "optimum": optimum,
+        "gap": None if optimum is None else best / optimum - 1,
+        "generations_to_gap": (
+            None if optimum is None else generations_to_gap(history["best"], optimum)
+        ),
+        "phase_times": {
+            key[5:]: float(value.sum())
+            for key, value in history.items()
+            if key.startswith("time_")
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def end_to_end_benchmarks(data_dir, instances, seeds, time_budget):
+    results = []
+    for instance in instances:
+        if not os.path.exists(f"{data_dir}/{instance}.tsp"):
+            print(f"Skipping {instance}: not found in {data_dir}")
+            continue
+        for seed in seeds:
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                run = executor.submit(
+                    end_to_end_run, data_dir, instance, seed, time_budget
+                ).result()
+            results.append(run)
+            gap = "n/a" if run["gap"] is None else f"{100 * run['gap']:.2f}%"
+            print(
+                f"{instance:<14} seed={seed:<4} {run['wall_time']:.2f} s, "
+                f"{run['generations']} generations, gap {gap}, "
+                f"{run['peak_rss_mb']:.0f} MB"
+            )
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=config.ROOT_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def run(args):
+    results = {"meta": metadata(), "micro": [], "end_to_end": []}
+    if not args.skip_micro:
+        results["micro"] = micro_benchmarks(GRIDS[args.grid], args.repeat, args.seed)
+        results["micro"] += read_benchmarks(args.data_dir, args.instances, args.repeat)
+    if not args.skip_end_to_end:
+        results["end_to_end"] = end_to_end_benchmarks(
+            args.data_dir, args.instances, args.seeds, args.time_budget
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def micro_key(result):
+    return (result["name"], result.get("instance"), result.get("n"), result.get("m"))
+
+
+def compare(args):
+    baseline = json.load(open(args.baseline))
+    current = json.load(open(args.current))
+    regressions = 0
+
+    baseline_micro = {micro_key(result): result for result in baseline["micro"]}
+    for result in current["micro"]:
+        reference = baseline_micro.get(micro_key(result))
+        if reference is None:
+            continue
+        ratio = result["median"] / reference["median"]
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = "  faster"
+        label = " ".join(str(part) for part in micro_key(result) if part is not None)
+        print(
+            f"{label:<44} {reference['median']:.2e} -> {result['median']:.2e} s"
+            f"  x{ratio:.2f}{flag}"
+        )
+
+    def by_instance(runs):
+        grouped = {}
+        for run in runs:
+            grouped.setdefault(run["instance"], []).append(run)
+        return grouped
+
+    baseline_runs = by_instance(baseline["end_to_end"])
+    for instance, runs in by_instance(current["end_to_end"]).items():
+        if instance not in baseline_runs:
+            continue
+        old_time = np.mean([run["wall_time"] for run in baseline_runs[instance]])
+        new_time = np.mean([run["wall_time"] for run in runs])
+        old_gap = np.mean([run["gap"] or 0.0 for run in baseline_runs[instance]])
+        new_gap = np.mean([run["gap"] or 0.0 for run in runs])
+        ratio = new_time / old_time
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        print(
+            f"{instance:<14} wall time {old_time:.2f} -> {new_time:.2f} s x{ratio:.2f}, "
+            f"mean gap {100 * old_gap:.2f}% -> {100 * new_gap:.2f}%{flag}"
+        )
+    print(f"{regressions} regression(s) above {100 * args.threshold:.0f}%")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument(
+        "--output", default=str(config.BENCHMARK_DIR / "latest.json")
+    )
+    run_parser.add_argument("--grid", choices=GRIDS, default="quick")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--data-dir", default=str(config.DATA_DIR / "tsp"))
+    run_parser.add_argument("--instances", nargs="+", default=INSTANCES)
+    run_parser.add_argument("--seeds", nargs="+", type=int, default=[0, 1, 2])
+    run_parser.add_argument("--time-budget", type=float, default=60.0)
+    run_parser.add_argument("--skip-micro", action="store_true")
+    run_parser.add_argument("--skip-end-to-end", action="store_true")
+
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,3 +2,5 @@ from pathlib import Path
 
 ROOT_DIR = Path(__file__).parent.parent.parent.resolve()
 DATA_DIR = ROOT_DIR / "data"
+CACHE_DIR = DATA_DIR / "cache"
+BENCHMARK_DIR = ROOT_DIR / "reports" / "benchmarks"
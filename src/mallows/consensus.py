@@ -0,0 +1,97 @@
+import numpy as np
+
+# Consensus solvers take the precedence matrix of m samples,
+# C[u, w] = number of samples with samples[:, u] < samples[:, w], and return
+# the central permutation together with its cost, the mean Kendall tau
+# distance to the samples (the mean inversion count used by estimate_theta).
+
+
+def _order_to_permutation(order):
+    return np.argsort(order)
+
+
+def _order_cost(precedence, order):
+    ordered = precedence[np.ix_(order, order)]
+    return np.tril(ordered, -1).sum()
+
+
+def consensus_cost(precedence, sigma_0, m):
+    return _order_cost(precedence, np.argsort(sigma_0)) / m
+
+
+def borda_consensus(precedence, m):
+    # Column sums of C are the position sums of the samples
+    position_sums = precedence.sum(axis=0)
+    sigma_0 = np.argsort(np.argsort((position_sums + m) / m))
+    return sigma_0, consensus_cost(precedence, sigma_0, m)
+
+
+def copeland_consensus(precedence, m):
+    # Pairwise majority wins, half a point for ties; Borda breaks ties
+    wins = (precedence > precedence.T).sum(axis=1) + 0.5 * (
+        (precedence == precedence.T).sum(axis=1) - 1
+    )
+    order = np.lexsort((precedence.sum(axis=0), -wins))
+    return _order_to_permutation(order), _order_cost(precedence, order) / m
+
+
+def _insertion_search(precedence, order):
+    # Moves single items to their best position until no move improves
+    order = order.copy()
+    improved = True
+    while improved:
+        improved = False
+        for a in order.copy():
+            i = np.flatnonzero(order == a)[0]
+            gain = precedence[a, order] - precedence[order, a]
+            forward = np.cumsum(gain[i + 1 :])
+            backward = np.cumsum(-gain[:i][::-1])
+            best_forward = forward.argmin() if forward.size else None
+            best_backward = backward.argmin() if backward.size else None
+            delta, j = 0, i
+            if best_forward is not None and forward[best_forward] < delta:
+                delta, j = forward[best_forward], i + 1 + best_forward
+            if best_backward is not None and backward[best_backward] < delta:
+                delta, j = backward[best_backward], i - 1 - best_backward
+            if delta < 0:
+                order = np.insert(np.delete(order, i), j, a)
+                improved = True
+    return order
+
+
+def insertion_consensus(precedence, m):
+    # Local search on the precedence matrix starting from the Borda ranking
+    sigma_0, _ = borda_consensus(precedence, m)
+    order = _insertion_search(precedence, np.argsort(sigma_0))
+    return _order_to_permutation(order), _order_cost(precedence, order) / m
+
+
+def branch_and_bound_consensus(precedence, m):
+    # Exact Kemeny consensus, meant for small n. Orders are built left to
+    # right; placing u next costs the samples that put a remaining item
+    # before u, and every remaining pair costs at least its minority count.
+    n = precedence.shape[0]
+    pair_bounds = np.minimum(precedence, precedence.T)
+    sigma_0, _ = insertion_consensus(precedence, m)
+    best_order = np.argsort(sigma_0)
+    best_cost = _order_cost(precedence, best_order)
+
+    def search(order, remaining, cost):
+        nonlocal best_order, best_cost
+        if remaining.size == 0:
+            if cost < best_cost:
+                best_order, best_cost = np.array(order), cost
+            return
+        block = np.ix_(remaining, remaining)
+        if cost + pair_bounds[block].sum() // 2 >= best_cost:
+            return
+        placement = precedence[block].sum(axis=0)
+        for k in np.argsort(placement, kind="stable"):
+            search(
+                order + [remaining[k]],
+                np.delete(remaining, k),
+                cost + placement[k],
+            )
+
+    search([], np.arange(n), 0)
+    return _order_to_permutation(best_order), best_cost / m
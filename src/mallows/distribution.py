@@ -1,76 +1,214 @@
+from collections import OrderedDict
+
 import numpy as np
 
+from mallows.metrics import InversionVectors
+
+
+def decode_inversion_vectors(V_values, out=None, columns=None):
+    # Inverse of mallows.metrics.InversionVectors: position j takes the
+    # V_j-th smallest value not used yet. The k-th smallest free value is
+    # found by binary lifting on a Fenwick tree of free values, one per row.
+    # Position j is written to column columns[j] of out, so a permutation of
+    # the columns costs nothing.
+    # Required shape: (n_permutations, space_size - 1)
+    m, n = V_values.shape[0], V_values.shape[1] + 1
+    if out is None:
+        out = np.empty((m, n), dtype=np.int64)
+    if columns is None:
+        columns = range(n)
+    width = n + 1
+    offsets = np.arange(0, m * width, width, dtype=np.int64)
+    lowbit = np.arange(width, dtype=np.int32)
+    lowbit &= -lowbit
+    tree = np.tile(lowbit, m)
+    steps = [1 << b for b in range(n.bit_length() - 1, -1, -1)]
+    pos = np.empty(m, dtype=np.int64)
+    rank = np.empty(m, dtype=np.int64)
+    nxt = np.empty(m, dtype=np.int64)
+    values = np.empty(m, dtype=np.int32)
+    for j in range(n):
+        pos[:] = 0
+        if j < n - 1:
+            rank[:] = V_values[:, j]
+            rank += 1
+        else:
+            rank[:] = 1
+        for step in steps:
+            np.add(pos, step, out=nxt)
+            np.minimum(nxt, n, out=nxt)
+            np.take(tree, offsets + nxt, out=values)
+            move = (values < rank) & (pos + step <= n)
+            np.copyto(pos, nxt, where=move)
+            rank -= np.where(move, values, 0)
+        out[:, columns[j]] = pos
+        pos += 1
+        for _ in range(len(steps)):
+            tree[offsets + np.minimum(pos, n)] -= pos <= n
+            pos += pos & -pos
+    return out
+
+
+def _log_abs_expm1(y):
+    # log|exp(y) - 1| without overflow for large y
+    positive = y > 0
+    y_positive = np.where(positive, y, 1.0)
+    y_negative = np.where(positive, -1.0, y)
+    return np.where(
+        positive,
+        y_positive + np.log(-np.expm1(-y_positive)),
+        np.log(-np.expm1(y_negative)),
+    )
+
+
+def _log_V(theta, K):
+    # log((1 - exp(-theta K)) / (1 - exp(-theta))), the log normaliser of V_j
+    theta = np.asarray(theta, dtype=np.float64)
+    nonzero_theta = np.where(theta == 0, 1.0, theta)
+    log_V = _log_abs_expm1(-nonzero_theta * K) - _log_abs_expm1(-nonzero_theta)
+    return np.where(theta == 0, np.log(K), log_V)
+
+
+class SamplerTables:
+    # Per-position cumulative distributions of V_j for one (n, theta):
+    # P(V_j <= r) = expm1(-theta (r + 1)) / expm1(-theta K_j) with
+    # K_j = n - j, so a table row is fully described by its denominator and
+    # V_j is drawn by inverting the CDF in closed form.
+    def __init__(self, n, theta):
+        self.n = n
+        self.theta = theta
+        self.K = n - np.arange(0, n - 1)
+        theta = np.broadcast_to(theta, self.K.shape)
+        self.uniform = theta == 0
+        # V_j under -theta is K_j - 1 - V_j under theta, so draws always use
+        # |theta| and expm1 cannot overflow
+        self.mirrored = theta < 0
+        self.nonzero_theta = np.where(self.uniform, 1.0, np.abs(theta))
+        self.cdf_scale = np.expm1(-self.nonzero_theta * self.K)
+        self.log_V = _log_V(theta, self.K)
+        self.log_normalization_constant = self.log_V.sum()
+        with np.errstate(over="ignore"):
+            self.normalization_constant = np.exp(self.log_normalization_constant)
+            self.V = np.exp(self.log_V)
+
+    def sample_V(self, rng, m):
+        u = rng.random((m, self.n - 1))
+        V_values = np.floor(np.log1p(u * self.cdf_scale) / -self.nonzero_theta)
+        V_values = np.where(self.uniform, np.floor(u * self.K), V_values)
+        V_values = np.clip(V_values, 0, self.K - 1)
+        V_values = np.where(self.mirrored, self.K - 1 - V_values, V_values)
+        return V_values.astype(np.int64)
+
+
+class SamplerCache:
+    # LRU cache of SamplerTables keyed by (n, theta rounded to `decimals`).
+    # With decimals=None only exactly repeated thetas hit the cache. Rounding
+    # is opt-in: it is absolute, so it changes the sampled distribution as
+    # soon as theta (which shrinks like 1 / n) is comparable to 10**-decimals.
+    def __init__(self, maxsize=32, decimals=None):
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+
+    def __call__(self, n, theta):
+        theta = np.array(theta, dtype=np.float64)
+        if self.decimals is not None:
+            theta = np.round(theta, self.decimals)
+        key = (n, theta.tobytes() if theta.ndim else float(theta))
+        tables = self._tables.get(key)
+        if tables is not None:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return tables
+        self.misses += 1
+        tables = SamplerTables(n, theta if theta.ndim else float(theta))
+        self._tables[key] = tables
+        if len(self._tables) > self.maxsize:
+            self._tables.popitem(last=False)
+        return tables
+
+    def clear(self):
+        self._tables.clear()
+
+
+default_sampler_cache = SamplerCache()
+
 
 class Mallows:
-    def __init__(self, sigma_0, theta, metric):
+    def __init__(self, sigma_0, theta, metric, rng=None, cache=None, dtype=np.int64):
         self.sigma_0 = sigma_0
-        self.theta = theta
+        # Sample column i is pi[sigma_0[i]], i.e. pi[j] lands in sigma_0_inv[j]
+        self.sigma_0_inv = np.argsort(sigma_0)
+        self.dtype = np.dtype(dtype)
         self.metric = metric
+        self.rng = np.random.default_rng(rng)
         self.n = len(sigma_0)
-        self.normalization_constant = self._compute_normalization_constant()
-        self.V = self._compute_V()
+        self.tables = (cache or default_sampler_cache)(self.n, theta)
+        # The tables may hold a rounded theta; probabilities are computed
+        # under the tables, i.e. the distribution actually sampled
+        self.theta = theta
+        self.log_V = self.tables.log_V
+        self.log_normalization_constant = self.tables.log_normalization_constant
+        self.normalization_constant = self.tables.normalization_constant
+        self.V = self.tables.V
 
     def sample(self):
+        # For a single permutation popping from a list beats the Fenwick decode
         possible_values = list(range(self.n))
-        pi = np.zeros(self.n, dtype=np.int64)
-        for j in range(0, self.n - 1):
-            r_j_dist = np.exp(-self.theta * np.arange(0, self.n - j)) / self.V[j]
-            r_j = np.random.choice(np.arange(0, self.n - j), p=r_j_dist)
-            pi[j] = possible_values[r_j]
-            del possible_values[r_j]
-        pi[self.n - 1] = possible_values[0]
-        sigma = pi[self.sigma_0]
-        return sigma
+        pi = np.array(
+            [possible_values.pop(r_j) for r_j in self.tables.sample_V(self.rng, 1)[0]]
+            + possible_values,
+            dtype=self.dtype,
+        )
+        return pi[self.sigma_0]
 
-    def sample_n(self, m):
-        V_values = np.zeros((m, self.n), dtype=np.int64)
-        for j in range(0, self.n - 1):
-            r_j_dist = np.exp(-self.theta * np.arange(0, self.n - j)) / self.V[j]
-            V_values[:, j] = np.random.choice(
-                np.arange(0, self.n - j), size=m, p=r_j_dist, replace=True
-            )
-        pi = np.zeros((m, self.n), dtype=np.int64)
-        identities = np.tile(np.arange(0, self.n), (m, 1))
-        identities_not_modified = np.tile(np.arange(0, self.n), (m, 1))
-        for j in range(0, self.n - 1):
-            pi[:, j] = identities[np.arange(0, m), V_values[:, j]]
-            identities[
-                (identities_not_modified.T >= V_values[:, j]).T
-                & (identities_not_modified.T < self.n - j - 1).T
-            ] = identities[
-                (identities_not_modified.T >= V_values[:, j] + 1).T
-                & (identities_not_modified.T < self.n - j).T
-            ]
-        pi[:, self.n - 1] = identities[:, 0]
-        return pi[:, self.sigma_0]
+    def sample_n(self, m, out=None):
+        V_values = self.tables.sample_V(self.rng, m)
+        if out is None:
+            out = np.empty((m, self.n), dtype=self.dtype)
+        return decode_inversion_vectors(V_values, out, self.sigma_0_inv)
 
     def probability(self, sigma):
-        return (
-            np.exp(-self.theta * self.metric(self.sigma_0, sigma))
-            / self.normalization_constant
+        return np.exp(self.log_probability(sigma))
+
+    def log_probability(self, sigma):
+        # Works on a single permutation or on an (m, n) batch
+        sigma = np.asarray(sigma)
+        pi = np.atleast_2d(sigma)[:, np.argsort(self.sigma_0)]
+        V_values = InversionVectors(self.n)(pi)
+        log_probability = (
+            -(V_values * self.tables.theta).sum(axis=1)
+            - self.log_normalization_constant
         )
+        return log_probability[0] if sigma.ndim == 1 else log_probability
+
+    def log_likelihood(self, samples):
+        return self.log_probability(np.atleast_2d(samples)).sum()
+
 
-    def _compute_normalization_constant(self):
-        prod = 1.0
-        for j in range(1, self.n):
-            prod *= (1 - np.exp(-self.theta * (self.n - j + 1))) / (
-                1 - np.exp(-self.theta)
-            )
-        return prod
-
-    def _compute_V(self):
-        return (1 - np.exp(-self.theta * (self.n - np.arange(1, self.n) + 1))) / (
-            1 - np.exp(-self.theta)
+class GeneralizedMallows(Mallows):
+    # One dispersion parameter per position of the inversion vector,
+    # theta[j] for j = 0, ..., n - 2. Each V_j keeps its own truncated
+    # geometric distribution, so sampling costs the same as for Mallows.
+    def __init__(
+        self, sigma_0, theta, metric=None, rng=None, cache=None, dtype=np.int64
+    ):
+        super().__init__(
+            sigma_0, np.asarray(theta, dtype=np.float64), metric, rng, cache, dtype
         )
 
 
 class Uniform:
-    def __init__(self, n):
+    def __init__(self, n, rng=None, dtype=np.int64):
         self.n = n
-        self.rng = np.random.default_rng()
+        self.rng = np.random.default_rng(rng)
+        self.dtype = np.dtype(dtype)
 
     def sample(self):
-        return self.rng.permutation(self.n)
+        return self.rng.permutation(self.n).astype(self.dtype)
 
     def sample_n(self, m):
-        return np.array([self.sample() for _ in range(m)])
+        population = np.tile(np.arange(self.n, dtype=self.dtype), (m, 1))
+        return self.rng.permuted(population, axis=1, out=population)
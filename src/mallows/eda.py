@@ -1,9 +1,35 @@
+import inspect
+from functools import partial
+
 import numpy as np
 from tqdm import tqdm
 
-from mallows.distribution import Mallows, Uniform
-from mallows.metrics import KendallTau
-from mallows.utils import estimate_mean, estimate_theta
+from mallows.distribution import GeneralizedMallows, Mallows, SamplerCache, Uniform
+from mallows.metrics import InversionVectors, KendallTau
+from mallows.perturbation import get_shake
+from mallows.population import FitnessCache, OffspringBuffer
+from mallows.selection import top_k_selection
+from mallows.telemetry import Telemetry, print_progress
+from mallows.theta import PositionThetaSolver, ThetaSolver
+from mallows.utils import (
+    ConsensusStatistics,
+    estimate_mean,
+    estimate_theta,
+    estimate_theta_vector,
+    permutation_dtype,
+)
+
+
+def _keyword_arguments(function):
+    # Names of the arguments a callable takes, "**" if it takes any keyword
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        return set()
+    return {
+        "**" if parameter.kind == parameter.VAR_KEYWORD else parameter.name
+        for parameter in parameters
+    }
 
 
 class EDA:
@@ -17,9 +43,34 @@ class EDA:
         n_iter,
         selection_function,
         restart_after_central_permutaition_fix,
+        theta_table_size=None,
+        rng=None,
+        shake_function=None,
+        local_search=None,
+        local_search_size=1,
+        incremental_consensus=False,
+        consensus_function=None,
+        generalized=False,
+        sampler_cache=None,
+        fitness_cache_size=None,
+        dtype=None,
+        telemetry=None,
+        scheduler=None,
+        chunk_size=None,
     ):
         self.problem_size = problem_size - 1
-        self.objective_function = lambda x: objective_function(x + 1)
+        # Populations hold the values 0..problem_size - 2, shifted by one for
+        # the objective function. Objective functions taking offset (e.g.
+        # TSPObjective) shift while copying and those taking out score
+        # straight into the population objectives.
+        arguments = _keyword_arguments(objective_function)
+        if "offset" in arguments:
+            self.objective_function = partial(objective_function, offset=1)
+        else:
+            self.objective_function = lambda x, **kwargs: objective_function(
+                x + 1, **kwargs
+            )
+        self.objective_out = "out" in arguments
         self.population_size = population_size
         self.selection_size = selection_size
         self.offspring_size = offspring_size
@@ -28,98 +79,307 @@ class EDA:
         self.restart_after_central_permutaition_fix = (
             restart_after_central_permutaition_fix
         )
+        self.theta_table_size = theta_table_size
+        self.rng = np.random.default_rng(rng)
+        # Selection functions written before the rng argument take two arguments
+        self.selection_kwargs = {}
+        if _keyword_arguments(selection_function) & {"rng", "**"}:
+            self.selection_kwargs["rng"] = self.rng
+        self.shake_function = shake_function or get_shake()
+        self.local_search = None
+        if local_search is not None:
+            self.local_search = lambda x: local_search(x + 1) - 1
+        self.local_search_size = local_search_size
+        self.incremental_consensus = incremental_consensus
+        self.consensus_function = consensus_function
+        self.generalized = generalized
+        # Each run gets its own cache; theta is not rounded unless a cache with
+        # decimals is passed
+        if sampler_cache is None:
+            sampler_cache = SamplerCache()
+        self.sampler_cache = sampler_cache
+        self.dtype = permutation_dtype(problem_size, dtype)
+        self.fitness_cache = None
+        if fitness_cache_size is not None:
+            self.fitness_cache = FitnessCache(
+                self.objective_function, fitness_cache_size
+            )
+        self.telemetry = telemetry
+        self.last_telemetry = None
+        self.scheduler = scheduler
+        self.stop_reason = None
+        self.chunk_size = chunk_size
 
-    def evolve(self, disable_tqdm=False):
-        population = Uniform(self.problem_size).sample_n(self.population_size)
+    def evolve(self, disable_tqdm=False, initial_population=None, verbose=True):
+        if initial_population is None:
+            population = Uniform(self.problem_size, self.rng, self.dtype).sample_n(
+                self.population_size
+            )
+        else:
+            population = np.array(initial_population, dtype=self.dtype)
         old_central_permutation = np.zeros(self.problem_size)
         central_permutation_repetitions = 0
         best_individual = None
         best_objective = np.inf
+        inversion_vectors = InversionVectors(self.problem_size)
+        if self.generalized:
+            model = GeneralizedMallows
+            theta_solver = PositionThetaSolver(self.problem_size)
+            estimate_dispersion = estimate_theta_vector
+        else:
+            model = Mallows
+            theta_solver = ThetaSolver(
+                self.problem_size, table_size=self.theta_table_size
+            )
+            estimate_dispersion = estimate_theta
+        dispersion_parameter = None
+        elite_objective = None
+        consensus_statistics = None
+        if self.incremental_consensus or self.consensus_function is not None:
+            consensus_statistics = ConsensusStatistics(self.problem_size)
+        telemetry = self.telemetry or Telemetry(enabled=verbose)
+        theta_shape = (self.problem_size - 1,) if self.generalized else ()
+        telemetry.start(self.n_iter, theta_shape)
+        progress = [print_progress()] if verbose else []
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.start()
+        self.stop_reason = None
+        # Objectives are scored into one buffer that is reused every generation
+        objectives_buffer = np.empty(
+            max(population.shape[0], self.population_size, 1 + self.offspring_size)
+        )
+        offspring_buffer = None
+        streamed = None
+        if self.chunk_size is not None:
+            # Streaming mode: offspring are scored chunk by chunk as they are
+            # sampled; top-k selection only needs the best rows to be kept
+            keep = None
+            if self.selection_function is top_k_selection:
+                keep = self.selection_size
+            offspring_buffer = OffspringBuffer(
+                1 + self.offspring_size,
+                self.problem_size,
+                self.dtype,
+                self.chunk_size,
+                keep,
+            )
+            chunk_counts = np.zeros(3, dtype=np.int64)
+            chunk_keys = []
+
+            def evaluate_chunk(chunk, out):
+                with telemetry.phase("evaluate"):
+                    self.evaluate(chunk, out=out)
+                chunk_counts[:] += self.count_evaluations(chunk)
+                if self.fitness_cache is not None:
+                    chunk_keys.append(self.fitness_cache.last_keys)
+
         for i in tqdm(range(self.n_iter), disable=disable_tqdm):
-            population_objectives = self.objective_function(population)
+            if streamed is None:
+                with telemetry.phase("evaluate"):
+                    population_objectives = self.evaluate(
+                        population,
+                        elite_objective,
+                        objectives_buffer[: population.shape[0]],
+                    )
+                m, unique, evaluated = self.count_evaluations(
+                    population, elite_objective
+                )
+                average = population_objectives.mean()
+            else:
+                population, population_objectives = streamed
+                m, unique, evaluated = (chunk_counts + [1, 1, 0]).tolist()
+                average = offspring_buffer.mean
+            telemetry.count("evaluations", evaluated)
+            if self.local_search is not None:
+                with telemetry.phase("local_search"):
+                    self.improve(population, population_objectives)
+                telemetry.count("local_search_calls")
 
             if population_objectives.min() < best_objective:
                 best_objective = population_objectives.min()
-                best_individual = population[population_objectives.argmin()]
-
-            selected_indices = self.selection_function(
-                population_objectives, self.selection_size
-            )
-            selected_population = population[selected_indices]
-            central_permutation = estimate_mean(selected_population)
-            dispersion_parameter = estimate_theta(
-                selected_population, central_permutation
-            )
-            offspring = Mallows(
-                central_permutation, dispersion_parameter, KendallTau(self.problem_size)
-            ).sample_n(self.offspring_size)
-            population = np.concatenate(
-                [
-                    population[np.argmin(population_objectives), :].reshape(1, -1),
-                    offspring,
-                ],
-                axis=0,
-            )
+                best_individual = population[population_objectives.argmin()].copy()
+            if scheduler is not None:
+                scheduler.update(i, best_objective)
 
-            if i % 100 == 0:
-                print(
-                    f"Generation {i} - Best: {population_objectives.min()}, Theta: {dispersion_parameter}"
+            with telemetry.phase("select"):
+                selected_indices = self.selection_function(
+                    population_objectives, self.selection_size, **self.selection_kwargs
                 )
-                print(f"Generation {i} - Average: {population_objectives.mean()}")
-                print(
-                    f"Generation {i} - Parents average: {population_objectives[selected_indices].mean()}"
+                selected_population = population[selected_indices]
+            if consensus_statistics is None:
+                with telemetry.phase("estimate_mean"):
+                    central_permutation = estimate_mean(selected_population)
+                with telemetry.phase("estimate_theta"):
+                    dispersion_parameter = estimate_dispersion(
+                        selected_population,
+                        central_permutation,
+                        inversion_vectors,
+                        dispersion_parameter,
+                        theta_solver,
+                    )
+            else:
+                with telemetry.phase("estimate_mean"):
+                    consensus_statistics.update(selected_population)
+                    central_permutation, V = consensus_statistics.estimate(
+                        self.consensus_function
+                    )
+                with telemetry.phase("estimate_theta"):
+                    if self.generalized:
+                        V = consensus_statistics.mean_inversion_vector(
+                            central_permutation
+                        )
+                    dispersion_parameter = theta_solver(V, dispersion_parameter)
+            offspring_size = self.offspring_size
+            if scheduler is not None:
+                offspring_size = scheduler.offspring_size(
+                    dispersion_parameter, offspring_size, self.selection_size
                 )
-                print(
-                    f"Generation {i} - Best individual repeats: {(population_objectives.argmin() == selected_indices).sum()}"
+            elite = population[np.argmin(population_objectives)]
+            elite_objective = population_objectives.min()
+            with telemetry.phase("sample"):
+                distribution = model(
+                    central_permutation,
+                    dispersion_parameter,
+                    KendallTau(self.problem_size),
+                    self.rng,
+                    self.sampler_cache,
+                    self.dtype,
                 )
-                print(
-                    f"Central permutation objective: {self.objective_function(central_permutation.reshape(1,-1))[0]}"
+                if offspring_buffer is None:
+                    offspring = distribution.sample_n(offspring_size)
+            if offspring_buffer is None:
+                population = np.concatenate([elite.reshape(1, -1), offspring], axis=0)
+            else:
+                chunk_counts[:] = 0
+                chunk_keys.clear()
+
+                def sample_chunk(k, out):
+                    with telemetry.phase("sample"):
+                        distribution.sample_n(k, out=out)
+
+                streamed = offspring_buffer.fill(
+                    elite, elite_objective, sample_chunk, evaluate_chunk, offspring_size
                 )
-                print(
-                    f"Central permutation repetitions: {central_permutation_repetitions}"
+                if chunk_keys:
+                    # Rows repeated across chunks or equal to the elite are
+                    # counted once, as in the batched population
+                    chunk_keys.append(
+                        self.fitness_cache.hash_rows(elite.reshape(1, -1))
+                    )
+                    chunk_counts[1] = np.unique(np.concatenate(chunk_keys)).size - 1
+
+            if telemetry.enabled:
+                log_likelihood = np.nan
+                if telemetry.log_likelihood:
+                    log_likelihood = distribution.log_probability(
+                        selected_population
+                    ).mean()
+                telemetry.record(
+                    dispersion_parameter,
+                    best=best_objective,
+                    average=average,
+                    parents_average=population_objectives[selected_indices].mean(),
+                    best_repeats=(
+                        population_objectives.argmin() == selected_indices
+                    ).sum(),
+                    central_permutation_repetitions=central_permutation_repetitions,
+                    population=m,
+                    unique=unique,
+                    evaluated=evaluated,
+                    log_likelihood=log_likelihood,
                 )
 
             if (central_permutation == old_central_permutation).all():
                 central_permutation_repetitions += 1
-                if (
-                    central_permutation_repetitions
-                    > self.restart_after_central_permutaition_fix
-                ):
+            else:
+                old_central_permutation = central_permutation
+                central_permutation_repetitions = 0
+            restart = (
+                central_permutation_repetitions
+                > self.restart_after_central_permutaition_fix
+            )
+            if scheduler is not None and scheduler.should_restart(i):
+                restart = True
+            if restart:
+                if verbose:
                     print("Applying shake procedure")
-                    population_objectives = self.objective_function(population)
+                with telemetry.phase("shake"):
+                    if streamed is None:
+                        population_objectives = self.evaluate(
+                            population,
+                            elite_objective,
+                            objectives_buffer[: population.shape[0]],
+                        )
+                    else:
+                        population, population_objectives = streamed
+                        streamed = None
+                    population_size = self.population_size
+                    if scheduler is not None:
+                        population_size = scheduler.population_size(
+                            dispersion_parameter, population_size, self.selection_size
+                        )
                     population = self.shake(
                         population[population_objectives.argmin(), :],
-                        self.population_size,
+                        population_size,
                     )
-                    central_permutation_repetitions = 0
-            else:
-                old_central_permutation = central_permutation
+                telemetry.count("shakes")
+                elite_objective = None
                 central_permutation_repetitions = 0
 
-        population_objectives = self.objective_function(population)
+            telemetry.end_generation(progress)
+            if scheduler is not None and scheduler.should_stop(i, dispersion_parameter):
+                self.stop_reason = scheduler.stop_reason
+                if verbose:
+                    print(f"Stopping after generation {i}: {self.stop_reason}")
+                break
+
+        if streamed is None:
+            population_objectives = self.evaluate(
+                population, elite_objective, objectives_buffer[: population.shape[0]]
+            )
+        else:
+            population, population_objectives = streamed
 
         if population_objectives.min() < best_objective:
             best_objective = population_objectives.min()
-            best_individual = population[population_objectives.argmin()]
+            best_individual = population[population_objectives.argmin()].copy()
 
+        self.last_telemetry = telemetry
         return central_permutation, dispersion_parameter, best_individual
 
+    def evaluate(self, population, elite_objective=None, out=None):
+        # Row 0 is the elite carried over from the previous generation; when its
+        # objective is known only the offspring are scored
+        if out is None:
+            out = np.empty(population.shape[0])
+        if self.fitness_cache is not None:
+            return self.fitness_cache(population, out=out)
+        start = 0
+        if elite_objective is not None:
+            out[0] = elite_objective
+            start = 1
+        if self.objective_out:
+            self.objective_function(population[start:], out=out[start:])
+        else:
+            out[start:] = self.objective_function(population[start:])
+        return out
+
+    def count_evaluations(self, population, elite_objective=None):
+        # Population size, unique rows and rows scored by the last evaluate
+        m = population.shape[0]
+        if self.fitness_cache is not None:
+            return m, self.fitness_cache.last_unique, self.fitness_cache.last_evaluated
+        return m, m, m - (elite_objective is not None)
+
+    def improve(self, population, population_objectives):
+        # Memetic step: local search on the best individuals, in place
+        k = min(self.local_search_size, population.shape[0])
+        best = top_k_selection(population_objectives, k)
+        population[best] = self.local_search(population[best])
+        population_objectives[best] = self.objective_function(population[best])
+
     def shake(self, permutation, population_size):
-        population = np.tile(permutation, (population_size, 1))
-        for i in range(population_size):
-            for _ in range(5):
-                idx = np.random.choice(self.problem_size)
-                new_idx = np.random.choice(
-                    np.arange(
-                        np.max([0, idx - 5]), np.min([self.problem_size, idx + 5])
-                    )
-                )
-                old_value = population[i, idx]
-                population[i, idx : self.problem_size - 1] = population[
-                    i, idx + 1 : self.problem_size
-                ]
-                population[i, new_idx + 1 : self.problem_size] = population[
-                    i, new_idx : self.problem_size - 1
-                ]
-                population[i, new_idx] = old_value
-        return population
+        return self.shake_function(
+            permutation.astype(self.dtype), population_size, rng=self.rng
+        )
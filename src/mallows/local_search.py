@@ -0,0 +1,159 @@
+import numpy as np
+
+from mallows.tsp_utils import get_neighbour_lists
+
+TWO_OPT = 0
+OR_OPT = 1
+
+
+class LocalSearch:
+    # 2-opt and Or-opt (segments of 1 to 3 cities) with neighbour lists and
+    # don't-look bits. Every step takes one city, evaluates the moves that
+    # connect it to one of its neighbours in all tours at once and applies the
+    # best improving move of every tour. City 0 stays at position 0.
+    def __init__(self, dist_matrix, n_neighbours=8, max_passes=10, or_opt=True):
+        self.dist_matrix = dist_matrix
+        self.n = dist_matrix.shape[0]
+        self.max_passes = max_passes
+        self.segment_lengths = (1, 2, 3) if or_opt else ()
+        cached = getattr(dist_matrix, "neighbours", None)
+        if cached is not None and cached.shape[1] >= n_neighbours:
+            self.neighbours = cached[:, :n_neighbours]
+        else:
+            self.neighbours, _ = get_neighbour_lists(dist_matrix, n_neighbours)
+
+    def __call__(self, permutations):
+        # Same convention as the objective function: permutations of 1..n-1
+        tours = np.zeros((permutations.shape[0], self.n), dtype=np.int64)
+        tours[:, 1:] = permutations
+        return self.optimize(tours)[:, 1:].astype(permutations.dtype)
+
+    def optimize(self, tours):
+        m, N = tours.shape
+        if N < 5:
+            return tours
+        tours = tours.copy()
+        all_positions = np.broadcast_to(np.arange(N), (m, N))
+        positions = np.empty_like(tours)
+        np.put_along_axis(positions, tours, all_positions, axis=1)
+        dont_look = np.zeros((m, N), dtype=bool)
+        for _ in range(self.max_passes):
+            improved = False
+            for a in range(N):
+                rows = np.flatnonzero(~dont_look[:, a])
+                if rows.size == 0:
+                    continue
+                delta, move = self._best_moves(tours[rows], positions[rows], a)
+                better = delta < -1e-9
+                dont_look[rows[~better], a] = True
+                if not better.any():
+                    continue
+                improved = True
+                rows = rows[better]
+                old_tours = tours[rows]
+                source = self._source_indices(move[better], N)
+                tours[rows] = np.take_along_axis(old_tours, source, axis=1)
+                new_positions = np.empty_like(old_tours)
+                np.put_along_axis(
+                    new_positions, tours[rows], all_positions[: rows.size], axis=1
+                )
+                positions[rows] = new_positions
+                # Cities whose tour neighbours changed are looked at again
+                changed = self._changed_cities(old_tours, tours[rows])
+                dont_look[rows] &= ~changed
+            if not improved:
+                break
+        return tours
+
+    def _best_moves(self, tours, positions, a):
+        D = self.dist_matrix
+        R, N = tours.shape
+        r = np.arange(R)[:, None]
+        c = self.neighbours[a][None, :]
+        i = positions[:, a][:, None]
+        j = positions[r, c]
+        zeros = np.zeros_like(j)
+        D_ac = D[a, c]
+        deltas, moves = [], []
+
+        # 2-opt joining a with c, replacing edges (a, succ a) and (c, succ c)
+        b = tours[r, (i + 1) % N]
+        d = tours[r, (j + 1) % N]
+        deltas.append(D_ac + D[b, d] - D[a, b] - D[c, d])
+        moves.append(
+            (zeros + TWO_OPT, np.minimum(i, j) + 1, np.maximum(i, j), zeros, zeros)
+        )
+        # 2-opt replacing edges (pred a, a) and (pred c, c)
+        p = tours[r, i - 1]
+        e = tours[r, j - 1]
+        deltas.append(D_ac + D[p, e] - D[p, a] - D[e, c])
+        i_prev, j_prev = (i - 1) % N, (j - 1) % N
+        moves.append(
+            (
+                zeros + TWO_OPT,
+                np.minimum(i_prev, j_prev) + 1,
+                np.maximum(i_prev, j_prev),
+                zeros,
+                zeros,
+            )
+        )
+
+        # Or-opt moving the segment that starts at a next to c
+        for L in self.segment_lengths:
+            valid = (i >= 1) & (i + L - 1 <= N - 1) & (N - L > 2)
+            end = tours[r, np.minimum(i + L - 1, N - 1)]
+            p = tours[r, i - 1]
+            nxt = tours[r, (i + L) % N]
+            removed = D[p, a] + D[end, nxt] - D[p, nxt]
+            in_segment = (j >= i) & (j <= i + L - 1)
+            # c, a, ..., end, succ c
+            d = tours[r, (j + 1) % N]
+            delta = D_ac + D[end, d] - D[c, d] - removed
+            delta[~(valid & ~in_segment & (j != i - 1))] = np.inf
+            deltas.append(delta)
+            moves.append((zeros + OR_OPT, i + zeros, zeros + L, j, zeros))
+            # pred c, end, ..., a, c
+            e = tours[r, j - 1]
+            delta = D[e, end] + D_ac - D[e, c] - removed
+            delta[~(valid & ~in_segment & (j != (i + L) % N))] = np.inf
+            deltas.append(delta)
+            moves.append((zeros + OR_OPT, i + zeros, zeros + L, (j - 1) % N, zeros + 1))
+
+        deltas = np.concatenate(deltas, axis=1)
+        moves = np.stack([np.concatenate(field, axis=1) for field in zip(*moves)])
+        best = deltas.argmin(axis=1)
+        return deltas[np.arange(R), best], moves[:, np.arange(R), best].T
+
+    @staticmethod
+    def _source_indices(moves, N):
+        # Position p of the new tour takes the city at source[p] of the old one
+        kind, x, y, t, reverse = (field[:, None] for field in moves.T)
+        P = np.arange(N)[None, :]
+        # 2-opt: reverse positions x..y
+        two_opt = np.where((P >= x) & (P <= y), x + y - P, P)
+        # Or-opt: move the segment of length y at x to just after position t
+        i, L = x, y
+        after = t > i + L - 1
+        or_opt = np.where(after & (P >= i) & (P <= t - L), P + L, P)
+        or_opt = np.where(~after & (P >= t + L + 1) & (P <= i + L - 1), P - L, or_opt)
+        start = np.where(after, t - L + 1, t + 1)
+        k = P - start
+        segment = (k >= 0) & (k < L)
+        or_opt = np.where(segment, np.where(reverse == 1, i + L - 1 - k, i + k), or_opt)
+        return np.where(kind == TWO_OPT, two_opt, or_opt)
+
+    @staticmethod
+    def _changed_cities(old_tours, new_tours):
+        def adjacent(tours):
+            succ = np.empty_like(tours)
+            pred = np.empty_like(tours)
+            np.put_along_axis(succ, tours, np.roll(tours, -1, axis=1), axis=1)
+            np.put_along_axis(pred, tours, np.roll(tours, 1, axis=1), axis=1)
+            return succ, pred
+
+        old_succ, old_pred = adjacent(old_tours)
+        new_succ, new_pred = adjacent(new_tours)
+        same = ((old_succ == new_succ) & (old_pred == new_pred)) | (
+            (old_succ == new_pred) & (old_pred == new_succ)
+        )
+        return ~same
@@ -0,0 +1,174 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from mallows.distribution import GeneralizedMallows, Mallows
+from mallows.eda import EDA
+from mallows.metrics import KendallTau
+from mallows.telemetry import Telemetry
+from mallows.tsp_utils import get_objective_function
+
+# Set once per worker process by the pool initializer
+_worker_state = {}
+
+
+@contextmanager
+def _worker_initializer(dist_matrix):
+    if not isinstance(dist_matrix, np.ndarray):
+        # CoordinateDistances is O(n) and is simply sent to every worker
+        yield _set_dist_matrix, (dist_matrix,)
+        return
+    shm = shared_memory.SharedMemory(create=True, size=max(dist_matrix.nbytes, 1))
+    try:
+        shared = np.ndarray(dist_matrix.shape, dtype=dist_matrix.dtype, buffer=shm.buf)
+        shared[:] = dist_matrix
+        yield _attach_dist_matrix, (shm.name, dist_matrix.shape, dist_matrix.dtype.str)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _set_dist_matrix(dist_matrix):
+    _worker_state["dist_matrix"] = dist_matrix
+    _worker_state["objective_function"] = get_objective_function(dist_matrix)
+
+
+def _attach_dist_matrix(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    _worker_state["shm"] = shm
+    _set_dist_matrix(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _make_eda(eda_params, seed):
+    dist_matrix = _worker_state["dist_matrix"]
+    return EDA(
+        dist_matrix.shape[0],
+        _worker_state["objective_function"],
+        rng=seed,
+        **eda_params,
+    )
+
+
+def _run_single(eda_params, seed):
+    eda = _make_eda(eda_params, seed)
+    eda.telemetry = eda.telemetry or Telemetry()
+    start = time.perf_counter()
+    central_permutation, dispersion_parameter, best_individual = eda.evolve(
+        disable_tqdm=True, verbose=False
+    )
+    return {
+        "history": eda.last_telemetry.history(),
+        "central_permutation": central_permutation,
+        "dispersion_parameter": dispersion_parameter,
+        "best_individual": best_individual,
+        "best_objective": eda.objective_function(best_individual.reshape(1, -1))[0],
+        "time": time.perf_counter() - start,
+    }
+
+
+def _run_island_epoch(eda_params, seed, state, migrants):
+    eda = _make_eda(eda_params, seed)
+    initial_population = None
+    if state is not None:
+        # The EDA population is the elite plus Mallows offspring, so an island
+        # is fully described by its best individual, mean and dispersion.
+        elite = np.stack([state["best_individual"]] + migrants).astype(eda.dtype)
+        model = GeneralizedMallows if eda.generalized else Mallows
+        offspring = model(
+            state["central_permutation"],
+            state["dispersion_parameter"],
+            KendallTau(eda.problem_size),
+            eda.rng,
+            eda.sampler_cache,
+            eda.dtype,
+        ).sample_n(eda.population_size - elite.shape[0])
+        initial_population = np.concatenate([elite, offspring], axis=0)
+    start = time.perf_counter()
+    central_permutation, dispersion_parameter, best_individual = eda.evolve(
+        disable_tqdm=True, initial_population=initial_population, verbose=False
+    )
+    best_objective = eda.objective_function(best_individual.reshape(1, -1))[0]
+    if state is not None and state["best_objective"] < best_objective:
+        best_individual = state["best_individual"]
+        best_objective = state["best_objective"]
+    return {
+        "central_permutation": central_permutation,
+        "dispersion_parameter": dispersion_parameter,
+        "best_individual": best_individual,
+        "best_objective": best_objective,
+        "time": time.perf_counter() - start,
+    }
+
+
+def _summarize(runs):
+    best_run = min(range(len(runs)), key=lambda i: runs[i]["best_objective"])
+    objectives = np.array([run["best_objective"] for run in runs])
+    return {
+        "best_individual": runs[best_run]["best_individual"],
+        "best_objective": runs[best_run]["best_objective"],
+        "best_run": best_run,
+        "objectives": objectives,
+        "mean_objective": objectives.mean(),
+        "std_objective": objectives.std(),
+        "runs": runs,
+    }
+
+
+def run_multistart(dist_matrix, n_runs, eda_params, seed=None, max_workers=None):
+    # eda_params are the EDA arguments other than problem_size and
+    # objective_function; the selection function has to be picklable.
+    seeds = np.random.SeedSequence(seed).spawn(n_runs)
+    with _worker_initializer(dist_matrix) as (initializer, initargs):
+        with ProcessPoolExecutor(
+            max_workers, initializer=initializer, initargs=initargs
+        ) as executor:
+            futures = [executor.submit(_run_single, eda_params, s) for s in seeds]
+            runs = [future.result() for future in futures]
+    return _summarize(runs)
+
+
+def run_island_model(
+    dist_matrix,
+    n_islands,
+    n_epochs,
+    eda_params,
+    seed=None,
+    max_workers=None,
+):
+    # Every epoch runs eda_params["n_iter"] generations on each island, then
+    # island i receives the best individual and the central permutation of
+    # island i - 1 (ring topology).
+    island_seeds = np.random.SeedSequence(seed).spawn(n_islands)
+    states = [None] * n_islands
+    trace = np.zeros((n_epochs, n_islands))
+    with _worker_initializer(dist_matrix) as (initializer, initargs):
+        with ProcessPoolExecutor(
+            max_workers, initializer=initializer, initargs=initargs
+        ) as executor:
+            for epoch in range(n_epochs):
+                futures = []
+                for island in range(n_islands):
+                    migrants = []
+                    source = states[island - 1]
+                    if source is not None:
+                        migrants = [
+                            source["best_individual"],
+                            source["central_permutation"],
+                        ]
+                    futures.append(
+                        executor.submit(
+                            _run_island_epoch,
+                            eda_params,
+                            island_seeds[island].spawn(1)[0],
+                            states[island],
+                            migrants,
+                        )
+                    )
+                states = [future.result() for future in futures]
+                trace[epoch] = [state["best_objective"] for state in states]
+    summary = _summarize(states)
+    summary["trace"] = trace
+    return summary
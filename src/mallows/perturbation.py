@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def _random_moves(rng, m, n, window):
+    # First position uniform, second uniform in [i - window, i + window)
+    i = rng.integers(n, size=m)
+    j = rng.integers(np.maximum(0, i - window), np.minimum(n, i + window))
+    return i[:, None], j[:, None]
+
+
+def insertion_moves(population, n_moves=5, window=5, rng=None):
+    # Removes the element at position i and reinserts it at position j
+    rng = np.random.default_rng(rng)
+    m, n = population.shape
+    positions = np.arange(n)[None, :]
+    for _ in range(n_moves):
+        i, j = _random_moves(rng, m, n, window)
+        source = np.broadcast_to(positions, (m, n)).copy()
+        source += (positions >= i) & (positions < j)
+        source -= (positions > j) & (positions <= i)
+        np.copyto(source, i, where=positions == j)
+        population = np.take_along_axis(population, source, axis=1)
+    return population
+
+
+def swap_moves(population, n_moves=5, window=5, rng=None):
+    rng = np.random.default_rng(rng)
+    m, n = population.shape
+    rows = np.arange(m)
+    population = population.copy()
+    for _ in range(n_moves):
+        i, j = _random_moves(rng, m, n, window)
+        i, j = i[:, 0], j[:, 0]
+        population[rows, i], population[rows, j] = (
+            population[rows, j],
+            population[rows, i],
+        )
+    return population
+
+
+def two_opt_moves(population, n_moves=5, window=5, rng=None):
+    # Reverses the segment between positions i and j
+    rng = np.random.default_rng(rng)
+    m, n = population.shape
+    positions = np.arange(n)[None, :]
+    for _ in range(n_moves):
+        i, j = _random_moves(rng, m, n, window)
+        lo, hi = np.minimum(i, j), np.maximum(i, j)
+        segment = (positions >= lo) & (positions <= hi)
+        source = np.where(segment, lo + hi - positions, positions)
+        population = np.take_along_axis(population, source, axis=1)
+    return population
+
+
+def get_shake(moves=insertion_moves, n_moves=5, window=5):
+    def shake(permutation, population_size, rng=None):
+        population = np.tile(permutation, (population_size, 1))
+        return moves(population, n_moves, window, rng)
+
+    return shake
@@ -0,0 +1,172 @@
+import numpy as np
+
+from mallows.selection import top_k_selection
+
+
+def _unique(keys):
+    # np.unique(keys, return_index=True, return_inverse=True) without the
+    # stable sort; any occurrence of a key serves as its representative
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    new = np.empty(keys.shape[0], dtype=bool)
+    new[:1] = True
+    np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=new[1:])
+    inverse = np.empty(keys.shape[0], dtype=np.intp)
+    inverse[order] = np.cumsum(new) - 1
+    return sorted_keys[new], order[new], inverse
+
+
+def _merge(current, new, idx, old):
+    # current with the rows of new inserted at positions idx of the result
+    merged = np.empty((old.shape[0],) + current.shape[1:], dtype=current.dtype)
+    merged[idx] = new
+    merged[old] = current
+    return merged
+
+
+class FitnessCache:
+    # Wraps an objective function on (m, n) populations. Duplicate rows are
+    # scored once and the objectives of the last `maxsize` distinct rows are
+    # kept, so only unique, unseen permutations reach the objective function.
+    # Rows are keyed by a random 64-bit linear hash; the cache is a key-sorted
+    # array looked up with searchsorted, and duplicates and hits are checked
+    # against the actual rows. Keying costs about as much as scoring a TSP
+    # tour, so the cache only pays off when duplicates are common (large
+    # theta) or the objective function is expensive.
+    def __init__(self, objective_function, maxsize=4096):
+        self.objective_function = objective_function
+        self.maxsize = maxsize
+        self.n_calls = 0
+        self.n_rows = 0
+        self.n_evaluated = 0
+        self.last_unique = 0
+        self.last_evaluated = 0
+        self.last_keys = np.empty(0, dtype=np.int64)
+        self._multipliers = np.empty(0, dtype=np.int64)
+        self.clear()
+
+    def hash_rows(self, population):
+        n = population.shape[1]
+        if self._multipliers.shape[0] != n:
+            # New row length: keys of the old rows are meaningless
+            rng = np.random.default_rng(n)
+            self._multipliers = rng.integers(0, 2**62, n, dtype=np.int64) * 2 + 1
+            self.clear()
+        return population @ self._multipliers
+
+    def __call__(self, population, out=None):
+        self.n_calls += 1
+        unique_keys, first, inverse = _unique(self.hash_rows(population))
+        self.last_keys = unique_keys
+        unique_rows = population[first]
+        duplicates = np.flatnonzero(first[inverse] != np.arange(inverse.shape[0]))
+        objectives = np.empty(unique_keys.shape[0])
+        idx = np.zeros(unique_keys.shape[0], dtype=np.intp)
+        found = np.zeros(unique_keys.shape[0], dtype=bool)
+        if self._keys.shape[0]:
+            idx = np.searchsorted(self._keys, unique_keys)
+            idx = np.minimum(idx, self._keys.shape[0] - 1)
+            found = self._keys[idx] == unique_keys
+        collision = (population[duplicates] != unique_rows[inverse[duplicates]]).any()
+        collision |= (self._rows[idx[found]] != unique_rows[found]).any()
+        if collision:
+            # Hash collision: score everything and leave the cache alone
+            self.n_rows += population.shape[0]
+            self.n_evaluated += population.shape[0]
+            self.last_unique = self.last_evaluated = population.shape[0]
+            if out is None:
+                return self.objective_function(population)
+            out[:] = self.objective_function(population)
+            return out
+        objectives[found] = self._objectives[idx[found]]
+        self._last_used[idx[found]] = self.n_calls
+        unseen = np.flatnonzero(~found)
+        if unseen.size:
+            objectives[unseen] = self.objective_function(unique_rows[unseen])
+            self._insert(unique_keys[unseen], unique_rows[unseen], objectives[unseen])
+        self.n_rows += population.shape[0]
+        self.n_evaluated += unseen.size
+        self.last_unique = unique_keys.shape[0]
+        self.last_evaluated = unseen.size
+        return np.take(objectives, inverse, out=out)
+
+    def _insert(self, keys, rows, objectives):
+        # keys come sorted, so they are merged in place. Rows inserted now are
+        # the most recently used: least recently used rows are evicted first
+        # and when the new rows alone fill the cache they replace it.
+        if keys.shape[0] >= self.maxsize or not self._keys.shape[0]:
+            self._keys = keys[: self.maxsize]
+            self._rows = rows[: self.maxsize]
+            self._objectives = objectives[: self.maxsize]
+            self._last_used = np.full(self._keys.shape[0], self.n_calls)
+            return
+        excess = self._keys.shape[0] + keys.shape[0] - self.maxsize
+        if excess > 0:
+            evicted = np.argpartition(self._last_used, excess - 1)[:excess]
+            keep = np.ones(self._keys.shape[0], dtype=bool)
+            keep[evicted] = False
+            self._keys = self._keys[keep]
+            self._rows = self._rows[keep]
+            self._objectives = self._objectives[keep]
+            self._last_used = self._last_used[keep]
+        size = self._keys.shape[0] + keys.shape[0]
+        idx = np.searchsorted(self._keys, keys) + np.arange(keys.shape[0])
+        old = np.ones(size, dtype=bool)
+        old[idx] = False
+        self._keys = _merge(self._keys, keys, idx, old)
+        self._rows = _merge(self._rows, rows, idx, old)
+        self._objectives = _merge(self._objectives, objectives, idx, old)
+        self._last_used = _merge(self._last_used, self.n_calls, idx, old)
+
+    def clear(self):
+        self._keys = np.empty(0, dtype=np.int64)
+        self._rows = np.empty((0, self._multipliers.shape[0]), dtype=np.int64)
+        self._objectives = np.empty(0)
+        self._last_used = np.empty(0, dtype=np.int64)
+
+
+class OffspringBuffer:
+    # Preallocated, double-buffered population filled chunk by chunk. Row 0
+    # is the elite; offspring are sampled straight into the buffer and scored
+    # as soon as a chunk is complete. With keep=k only the k best rows seen so
+    # far are retained, in their original order and with the tie-break of
+    # top_k_selection, which is all top-k selection needs and selects the same
+    # rows as on the whole population. The buffer holds k + chunk_size rows
+    # instead of the whole population. Filling alternates between the two
+    # buffers, so views into the previous population, e.g. the elite, stay
+    # valid.
+    def __init__(self, size, n, dtype, chunk_size, keep=None):
+        self.chunk_size = chunk_size
+        self.keep = keep
+        rows = size if keep is None else min(size, keep + chunk_size)
+        self._populations = [np.empty((rows, n), dtype=dtype) for _ in range(2)]
+        self._objectives = [np.empty(rows) for _ in range(2)]
+        self._current = 0
+        self.n_rows = 0
+        self.mean = np.nan
+
+    def fill(self, elite, elite_objective, sample, evaluate, m):
+        # sample(k, out) draws k offspring into out, evaluate(rows, out) scores
+        # them into out
+        self._current ^= 1
+        population = self._populations[self._current]
+        objectives = self._objectives[self._current]
+        population[0] = elite
+        objectives[0] = elite_objective
+        filled = 1
+        total = elite_objective
+        for start in range(0, m, self.chunk_size):
+            k = min(self.chunk_size, m - start)
+            chunk = population[filled : filled + k]
+            sample(k, chunk)
+            evaluate(chunk, objectives[filled : filled + k])
+            total += objectives[filled : filled + k].sum()
+            filled += k
+            if self.keep is not None and filled > self.keep:
+                best = top_k_selection(objectives[:filled], self.keep)
+                population[: self.keep] = population[best]
+                objectives[: self.keep] = objectives[best]
+                filled = self.keep
+        self.n_rows = m + 1
+        self.mean = total / self.n_rows
+        return population[:filled], objectives[:filled]
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+
+
+class Scheduler:
+    # Termination and restart policy for EDA.evolve, consulted once per
+    # generation. A run stops when the best objective reaches
+    # target * (1 + tolerance), when theta exceeds theta_max at every
+    # position, after `patience` generations without improvement or once
+    # time_budget seconds have passed. restart_patience triggers the shake
+    # after that many generations without improvement. With adapt_theta set,
+    # the offspring size and the size of the population drawn by the shake
+    # shrink as theta_adapt / theta once theta passes it, down to
+    # min_offspring_fraction of the configured sizes.
+    def __init__(
+        self,
+        target=None,
+        tolerance=0.0,
+        theta_max=None,
+        patience=None,
+        time_budget=None,
+        restart_patience=None,
+        adapt_theta=None,
+        min_offspring_fraction=0.1,
+    ):
+        self.target = target
+        self.tolerance = tolerance
+        self.theta_max = theta_max
+        self.patience = patience
+        self.time_budget = time_budget
+        self.restart_patience = restart_patience
+        self.adapt_theta = adapt_theta
+        self.min_offspring_fraction = min_offspring_fraction
+        self.start()
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self.best_objective = np.inf
+        self.last_improvement = 0
+        self.last_restart = 0
+        self.stop_reason = None
+
+    def update(self, generation, best_objective):
+        if best_objective < self.best_objective:
+            self.best_objective = best_objective
+            self.last_improvement = generation
+
+    def should_stop(self, generation, theta):
+        if self.target is not None and self.best_objective <= self.target * (
+            1 + self.tolerance
+        ):
+            self.stop_reason = "target"
+        elif self.theta_max is not None and np.min(theta) >= self.theta_max:
+            self.stop_reason = "theta"
+        elif (
+            self.patience is not None
+            and generation - self.last_improvement >= self.patience
+        ):
+            self.stop_reason = "patience"
+        elif (
+            self.time_budget is not None
+            and time.perf_counter() - self._start_time >= self.time_budget
+        ):
+            self.stop_reason = "time"
+        return self.stop_reason is not None
+
+    def should_restart(self, generation):
+        if self.restart_patience is None:
+            return False
+        stagnant = generation - max(self.last_improvement, self.last_restart)
+        if stagnant < self.restart_patience:
+            return False
+        self.last_restart = generation
+        return True
+
+    def _scale(self, theta, size, min_size):
+        if self.adapt_theta is None or theta is None:
+            return size
+        fraction = np.clip(
+            self.adapt_theta / max(np.mean(theta), 1e-12),
+            self.min_offspring_fraction,
+            1.0,
+        )
+        # Only ever shrinks: EDA buffers are sized from the configured sizes
+        return min(size, max(int(np.ceil(fraction * size)), min_size))
+
+    def offspring_size(self, theta, offspring_size, min_size=1):
+        return self._scale(theta, offspring_size, min_size)
+
+    def population_size(self, theta, population_size, min_size=1):
+        # Size of the population drawn by the shake
+        return self._scale(theta, population_size, min_size)
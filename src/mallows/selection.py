@@ -1,36 +1,88 @@
+from functools import lru_cache
+
 import numpy as np
 
+# Rank-based selections weight the j-th best individual by a table that only
+# depends on the population size N. The tables are kept as cumulative sums and
+# sampled with searchsorted.
+
+
+def _sample_cdf(cdf, k, rng):
+    u = rng.random(k) * cdf[-1]
+    return np.minimum(np.searchsorted(cdf, u, side="right"), cdf.shape[0] - 1)
+
+
+def _sample_cdf_universal(cdf, k, rng):
+    # Stochastic universal sampling: k evenly spaced pointers, one random offset
+    pointers = (rng.random() + np.arange(k)) * (cdf[-1] / k)
+    return np.minimum(np.searchsorted(cdf, pointers, side="right"), cdf.shape[0] - 1)
+
+
+def top_k_selection(population_objectives, k, rng=None):
+    # Indices of the k best in increasing order. Ties at the k-th objective go
+    # to the lowest indices, so the selected set is deterministic and a
+    # running top-k over chunks (OffspringBuffer) selects the same rows.
+    if k >= population_objectives.shape[0]:
+        return np.arange(population_objectives.shape[0])
+    kth = np.partition(population_objectives, k - 1)[k - 1]
+    selected = population_objectives < kth
+    tied = np.flatnonzero(population_objectives == kth)
+    selected[tied[: k - np.count_nonzero(selected)]] = True
+    return np.flatnonzero(selected)
+
 
-def top_k_selection(population_objectives, k):
-    return population_objectives.argsort()[:k]
+@lru_cache(maxsize=16)
+def _linear_rank_cdf(N, alpha, beta):
+    # Best individual gets beta / N, worst alpha / N
+    ranks = np.arange(N - 1, -1, -1) / max(N - 1, 1)
+    cdf = np.cumsum((alpha + ranks * (beta - alpha)) / N)
+    cdf.flags.writeable = False
+    return cdf
 
 
-def get_linear_ranking_selection(alpha, beta):
+def get_linear_ranking_selection(alpha, beta, universal=False):
     assert 0 <= alpha and alpha <= beta and beta <= 2 and alpha + beta <= 2
+    sample = _sample_cdf_universal if universal else _sample_cdf
 
-    def linear_ranking_selection(population_objectives, k):
+    def linear_ranking_selection(population_objectives, k, rng=None):
+        rng = np.random.default_rng(rng)
         N = population_objectives.shape[0]
-        ranks = np.argsort(population_objectives)[::-1]
-        probabilities = (alpha + (ranks / (N - 1)) * (beta - alpha)) / N
-        selected_indices = np.random.choice(N, k, replace=True, p=probabilities)
-        return selected_indices
+        order = np.argsort(population_objectives)
+        return order[sample(_linear_rank_cdf(N, alpha, beta), k, rng)]
 
     return linear_ranking_selection
 
 
-def exponential_ranking_selection(population_objectives, k):
-    N = population_objectives.shape[0]
-    ranks = np.argsort(population_objectives)[::-1]
-    probabilities = 1 - np.exp(-ranks)
-    probabilities /= probabilities.sum()
-    selected_indices = np.random.choice(N, k, replace=True, p=probabilities)
-    return selected_indices
+@lru_cache(maxsize=16)
+def _exponential_rank_cdf(N):
+    ranks = np.arange(N - 1, -1, -1)
+    cdf = np.cumsum(-np.expm1(-ranks))
+    cdf.flags.writeable = False
+    return cdf
 
 
-def adaptation_roulette_selection(population_objectives, k):
+def exponential_ranking_selection(population_objectives, k, rng=None):
+    rng = np.random.default_rng(rng)
     N = population_objectives.shape[0]
+    order = np.argsort(population_objectives)
+    return order[_sample_cdf(_exponential_rank_cdf(N), k, rng)]
+
+
+def _roulette_cdf(population_objectives):
     worst = population_objectives.max()
-    probabilities = worst - population_objectives
-    probabilities /= probabilities.sum()
-    selected_indices = np.random.choice(N, k, replace=True, p=probabilities)
-    return selected_indices
+    cdf = np.cumsum(worst - population_objectives)
+    if cdf[-1] <= 0:
+        # All objectives equal
+        return np.arange(1.0, population_objectives.shape[0] + 1)
+    return cdf
+
+
+def adaptation_roulette_selection(population_objectives, k, rng=None):
+    rng = np.random.default_rng(rng)
+    return _sample_cdf(_roulette_cdf(population_objectives), k, rng)
+
+
+def stochastic_universal_sampling(population_objectives, k, rng=None):
+    # Same weights as adaptation_roulette_selection, lower variance
+    rng = np.random.default_rng(rng)
+    return _sample_cdf_universal(_roulette_cdf(population_objectives), k, rng)
@@ -0,0 +1,129 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+PHASES = (
+    "evaluate",
+    "local_search",
+    "select",
+    "estimate_mean",
+    "estimate_theta",
+    "sample",
+    "shake",
+)
+TRACES = (
+    "best",
+    "average",
+    "parents_average",
+    "best_repeats",
+    "central_permutation_repetitions",
+    "population",
+    "unique",
+    "evaluated",
+    "log_likelihood",
+)
+
+
+class Telemetry:
+    # Per-generation history of an EDA run: wall time of every phase, traces
+    # of the objective and of theta, and run-wide counters. Arrays are
+    # allocated once per run by start(). With enabled=False the phase timers
+    # are no-ops and nothing is recorded. Callbacks are called as
+    # callback(generation, telemetry) after every generation.
+    def __init__(self, callbacks=(), enabled=True, log_likelihood=False):
+        self.callbacks = list(callbacks)
+        self.enabled = enabled
+        self.log_likelihood = log_likelihood
+        self.n_generations = 0
+        self.start(0)
+
+    def start(self, n_iter, theta_shape=()):
+        self.n_generations = 0
+        self.phase_times = np.zeros((n_iter, len(PHASES)))
+        self.traces = {name: np.full(n_iter, np.nan) for name in TRACES}
+        self.theta = np.full((n_iter,) + tuple(theta_shape), np.nan)
+        self.counters = {"evaluations": 0, "shakes": 0, "local_search_calls": 0}
+        self._start_time = time.perf_counter()
+        self.wall_time = 0.0
+
+    def phase(self, name):
+        if not self.enabled:
+            return nullcontext()
+        return self._timer(PHASES.index(name))
+
+    @contextmanager
+    def _timer(self, column):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_times[self.n_generations, column] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record(self, theta, **values):
+        if not self.enabled:
+            return
+        i = self.n_generations
+        self.theta[i] = theta
+        for name, value in values.items():
+            self.traces[name][i] = value
+
+    def end_generation(self, callbacks=()):
+        if not self.enabled:
+            return
+        self.wall_time = time.perf_counter() - self._start_time
+        for callback in self.callbacks + list(callbacks):
+            callback(self.n_generations, self)
+        self.n_generations += 1
+
+    def history(self):
+        # Recorded generations only, as a flat dict of arrays
+        k = self.n_generations
+        history = {"generation": np.arange(k), "theta": self.theta[:k]}
+        history.update({name: trace[:k] for name, trace in self.traces.items()})
+        history.update(
+            {f"time_{phase}": self.phase_times[:k, j] for j, phase in enumerate(PHASES)}
+        )
+        return history
+
+    def to_npz(self, path):
+        history = self.history()
+        history.update({f"count_{name}": v for name, v in self.counters.items()})
+        np.savez(path, wall_time=self.wall_time, **history)
+
+    def to_csv(self, path):
+        history = self.history()
+        theta = history.pop("theta").reshape(self.n_generations, -1)
+        names = list(history)
+        columns = [history[name] for name in names]
+        if theta.shape[1] == 1:
+            names.insert(1, "theta")
+        else:
+            names[1:1] = [f"theta_{j}" for j in range(theta.shape[1])]
+        table = np.column_stack([columns[0], theta] + columns[1:])
+        np.savetxt(path, table, delimiter=",", header=",".join(names), comments="")
+
+
+def print_progress(every=100):
+    # Callback reproducing the periodic console report of EDA.evolve
+    def callback(generation, telemetry):
+        if generation % every:
+            return
+        traces = {name: trace[generation] for name, trace in telemetry.traces.items()}
+        theta = telemetry.theta[generation]
+        print(
+            f"Generation {generation} - Best: {traces['best']}, Theta: {theta}\n"
+            f"Generation {generation} - Average: {traces['average']}\n"
+            f"Generation {generation} - Parents average: {traces['parents_average']}\n"
+            f"Generation {generation} - Best individual repeats: {int(traces['best_repeats'])}\n"
+            f"Generation {generation} - Unique: {int(traces['unique'])}, Evaluated: {int(traces['evaluated'])}\n"
+            f"Central permutation repetitions: {int(traces['central_permutation_repetitions'])}"
+        )
+        if telemetry.log_likelihood:
+            print(f"Parents mean log-likelihood: {traces['log_likelihood']}")
+
+    return callback
@@ -0,0 +1,136 @@
+import numpy as np
+
+
+def _h(x):
+    # 1 / expm1(x) - 1 / x, with the removable singularity at 0 handled by
+    # its Taylor series and overflow of expm1 mapped to the proper limit.
+    x = np.asarray(x, dtype=np.float64)
+    small = np.abs(x) < 1e-2
+    x_small = np.where(small, x, 0.0)
+    x_large = np.where(small, 1.0, x)
+    with np.errstate(over="ignore"):
+        large = 1.0 / np.expm1(x_large) - 1.0 / x_large
+    series = -0.5 + x_small / 12.0 - x_small**3 / 720.0 + x_small**5 / 30240.0
+    return np.where(small, series, large)
+
+
+def _h_prime(x):
+    x = np.asarray(x, dtype=np.float64)
+    small = np.abs(x) < 1e-2
+    x_small = np.where(small, x, 0.0)
+    x_large = np.where(small, 1.0, x)
+    with np.errstate(over="ignore"):
+        large = 1.0 / x_large**2 - 1.0 / (np.expm1(x_large) * -np.expm1(-x_large))
+    series = 1.0 / 12.0 - x_small**2 / 240.0 + x_small**4 / 6048.0
+    return np.where(small, series, large)
+
+
+class ThetaSolver:
+    # Solves E_theta[V] = V for the Mallows dispersion under Kendall tau,
+    # where E_theta[V] = sum_{k=2}^{n} 1 / expm1(theta) - k / expm1(k theta).
+    # The function is decreasing in theta, so a bracketed Newton step with a
+    # bisection fallback always converges.
+    def __init__(
+        self, n, tol=1e-5, max_iter=100, theta_max=100.0, table_size=None, refine=True
+    ):
+        self.n = n
+        self.tol = tol
+        self.max_iter = max_iter
+        self.theta_max = theta_max
+        self.refine = refine
+        self.k = np.arange(2, n + 1, dtype=np.float64)
+        self.max_inversions = n * (n - 1) / 2.0
+        self.table = None
+        if table_size is not None:
+            self.table = self._build_table(table_size)
+
+    def expected_inversions(self, theta):
+        return (self.n - 1) * _h(theta) - np.sum(self.k * _h(self.k * theta))
+
+    def expected_inversions_prime(self, theta):
+        return (self.n - 1) * _h_prime(theta) - np.sum(
+            self.k**2 * _h_prime(self.k * theta)
+        )
+
+    def _build_table(self, table_size):
+        # Dense near 0, where theta changes fastest relative to V.
+        positive = np.expm1(np.linspace(0.0, np.log1p(self.theta_max), table_size))
+        thetas = np.concatenate([-positive[:0:-1], positive])
+        expected = np.array([self.expected_inversions(theta) for theta in thetas])
+        # np.interp needs increasing abscissae
+        return expected[::-1], thetas[::-1]
+
+    def __call__(self, V, theta_0=None):
+        if V <= 0:
+            return self.theta_max
+        if V >= self.max_inversions:
+            return -self.theta_max
+        if self.table is not None:
+            theta_0 = np.interp(V, *self.table)
+            if not self.refine:
+                return theta_0
+        if theta_0 is None:
+            theta_0 = 0.01
+
+        lo, hi = -self.theta_max, self.theta_max
+        x = min(max(theta_0, lo), hi)
+        for _ in range(self.max_iter):
+            f_x = self.expected_inversions(x) - V
+            if f_x > 0:
+                lo = x
+            else:
+                hi = x
+            f_prime_x = self.expected_inversions_prime(x)
+            if f_prime_x < 0:
+                x_new = x - f_x / f_prime_x
+            if f_prime_x >= 0 or not lo < x_new < hi:
+                x_new = 0.5 * (lo + hi)
+            if np.abs(x_new - x) < self.tol or hi - lo < self.tol:
+                return x_new
+            x = x_new
+        return x
+
+
+class PositionThetaSolver:
+    # Per-position fit for the Generalized Mallows model. Position j solves
+    # E[V_j] = 1 / expm1(theta_j) - K_j / expm1(K_j theta_j) = V_j, K_j = n - j,
+    # with the same safeguarded Newton iteration as ThetaSolver, run on all
+    # positions at once.
+    def __init__(self, n, tol=1e-5, max_iter=100, theta_max=100.0):
+        self.n = n
+        self.tol = tol
+        self.max_iter = max_iter
+        self.theta_max = theta_max
+        self.K = n - np.arange(0, n - 1, dtype=np.float64)
+
+    def expected_inversions(self, theta):
+        return _h(theta) - self.K * _h(self.K * theta)
+
+    def expected_inversions_prime(self, theta):
+        return _h_prime(theta) - self.K**2 * _h_prime(self.K * theta)
+
+    def __call__(self, V, theta_0=None):
+        V = np.asarray(V, dtype=np.float64)
+        lo = np.full(V.shape, -self.theta_max)
+        hi = np.full(V.shape, self.theta_max)
+        if theta_0 is None:
+            theta_0 = 0.01
+        x = np.clip(np.broadcast_to(theta_0, V.shape), lo, hi).astype(np.float64)
+        # Positions without a finite solution are set at the end
+        done = (V <= 0) | (V >= self.K - 1)
+        for _ in range(self.max_iter):
+            if done.all():
+                break
+            f_x = self.expected_inversions(x) - V
+            lo = np.where(f_x > 0, x, lo)
+            hi = np.where(f_x > 0, hi, x)
+            f_prime_x = self.expected_inversions_prime(x)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_new = x - f_x / f_prime_x
+            bisect = (f_prime_x >= 0) | ~((lo < x_new) & (x_new < hi))
+            x_new = np.where(bisect, 0.5 * (lo + hi), x_new)
+            converged = (np.abs(x_new - x) < self.tol) | (hi - lo < self.tol)
+            x = np.where(done, x, x_new)
+            done |= converged
+        x = np.where(V <= 0, self.theta_max, x)
+        return np.where(V >= self.K - 1, -self.theta_max, x)
@@ -1,11 +1,124 @@
+import hashlib
 import os
+import shutil
+import tempfile
+from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.lines import Line2D
 
+from mallows import config
+
+COORD_EDGE_WEIGHT_TYPES = ("EUC_2D", "EUC_3D", "CEIL_2D", "ATT", "GEO")
+
+
+def prepare_coords(coords, edge_weight_type):
+    # GEO coordinates are given as DDD.MM and are converted to radians
+    if edge_weight_type == "GEO":
+        deg = np.trunc(coords)
+        return np.pi * (deg + 5.0 * (coords - deg) / 3.0) / 180.0
+    return np.asarray(coords, dtype=np.float64)
+
+
+def edge_lengths(a, b, edge_weight_type):
+    # Distances between prepared coordinates, rounded as in TSPLIB.
+    # Coordinates are on the last axis, the other axes broadcast.
+    if edge_weight_type == "GEO":
+        RRR = 6378.388
+        q1 = np.cos(a[..., 1] - b[..., 1])
+        q2 = np.cos(a[..., 0] - b[..., 0])
+        q3 = np.cos(a[..., 0] + b[..., 0])
+        cos = np.clip(0.5 * ((1.0 + q1) * q2 - (1.0 - q1) * q3), -1.0, 1.0)
+        return np.trunc(RRR * np.arccos(cos) + 1.0)
+    diff = a - b
+    squared = np.einsum("...i,...i->...", diff, diff)
+    if edge_weight_type == "ATT":
+        r = np.sqrt(squared / 10.0)
+        t = np.floor(r + 0.5)
+        return np.where(t < r, t + 1.0, t)
+    if edge_weight_type == "CEIL_2D":
+        return np.ceil(np.sqrt(squared))
+    if edge_weight_type in ("EUC_2D", "EUC_3D"):
+        return np.floor(np.sqrt(squared) + 0.5)
+    raise ValueError("Edge weight type not supported")
+
+
+def get_dist_matrix_from_coords(
+    coords, edge_weight_type, dtype=np.float64, chunk_size=None
+):
+    # Rows are computed in blocks so temporaries stay at chunk_size x n
+    n = coords.shape[0]
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(n, 1))
+    prepared = prepare_coords(coords, edge_weight_type)
+    dist_matrix = np.empty((n, n), dtype=dtype)
+    for start in range(0, n, chunk_size):
+        dist_matrix[start : start + chunk_size] = edge_lengths(
+            prepared[start : start + chunk_size, None, :],
+            prepared[None, :, :],
+            edge_weight_type,
+        )
+    np.fill_diagonal(dist_matrix, 0)
+    return dist_matrix
+
+
+def get_neighbour_lists(dist_matrix, k, chunk_size=None):
+    # k nearest neighbours of every city, sorted by distance, computed in
+    # row blocks so it also works on CoordinateDistances without an n x n array
+    n = dist_matrix.shape[0]
+    k = min(k, n - 1)
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(n, 1))
+    neighbours = np.empty((n, k), dtype=np.int64)
+    neighbour_distances = np.empty((n, k), dtype=np.float64)
+    columns = np.arange(n)
+    for start in range(0, n, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n))
+        block = np.array(dist_matrix[rows[:, None], columns[None, :]], dtype=np.float64)
+        block[np.arange(rows.shape[0]), rows] = np.inf
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        distances = np.take_along_axis(block, nearest, axis=1)
+        order = np.argsort(distances, axis=1, kind="stable")
+        neighbours[rows] = np.take_along_axis(nearest, order, axis=1)
+        neighbour_distances[rows] = np.take_along_axis(distances, order, axis=1)
+    return neighbours, neighbour_distances
+
+
+class CoordinateDistances:
+    # Stands in for the dense distance matrix: dist[rows, cols] computes the
+    # edge lengths from coordinates on the fly, so memory is O(n).
+    # cache_neighbours keeps the k nearest neighbours of every city as
+    # candidate lists for LocalSearch; lookups always recompute the length,
+    # which is cheaper than searching the lists.
+    def __init__(self, coords, edge_weight_type, dtype=np.float64):
+        self.coords = coords
+        self.edge_weight_type = edge_weight_type
+        self.dtype = np.dtype(dtype)
+        self.prepared = prepare_coords(coords, edge_weight_type)
+        self.shape = (coords.shape[0], coords.shape[0])
+        self.neighbours = None
+        self.neighbour_distances = None
+
+    def cache_neighbours(self, k, chunk_size=None):
+        self.neighbours, self.neighbour_distances = get_neighbour_lists(
+            self, k, chunk_size
+        )
+        return self
+
+    def __getitem__(self, index):
+        rows, cols = np.broadcast_arrays(*map(np.asarray, index))
+        lengths = np.empty(rows.shape, dtype=self.dtype)
+        lengths[...] = edge_lengths(
+            self.prepared[rows], self.prepared[cols], self.edge_weight_type
+        )
+        lengths[rows == cols] = 0
+        return lengths
 
-def read_tsp_file(filepath, is_opt=False):
+
+def read_tsp_file(
+    filepath, is_opt=False, dtype=np.float64, chunk_size=None, lazy=False
+):
     def get_dimension(file):
         for line in file:
             if line.startswith("DIMENSION"):
@@ -51,25 +164,7 @@ def read_tsp_file(filepath, is_opt=False):
                 return index
 
     def get_coords(lines):
-        coords = np.zeros((n, 2))
-        for index, line in enumerate(lines):
-            coords[index, :] = np.array(
-                list(
-                    map(
-                        lambda x: float(x),
-                        list(filter(lambda x: x != "", line.split()))[1:],
-                    )
-                )
-            )
-        return coords
-
-    def get_dist_matrix_from_coords(coords):
-        dist_matrix = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i + 1, n):
-                dist_matrix[i, j] = np.sqrt(np.sum((coords[i, :] - coords[j, :]) ** 2))
-                dist_matrix[j, i] = dist_matrix[i, j]
-        return dist_matrix
+        return np.array([line.split()[1:] for line in lines], dtype=np.float64)
 
     def get_solution_loc(lines):
         for index, line in enumerate(lines):
@@ -82,30 +177,6 @@ def read_tsp_file(filepath, is_opt=False):
             optimal_solution[index] = int(line.split()[0]) - 1
         return optimal_solution
 
-    def get_dist_matrix_from_geo_coords(coords):
-        def geo_distance(coord1, coord2):
-            RRR = 6378.388
-            q1 = np.cos(coord1[1] - coord2[1])
-            q2 = np.cos(coord1[0] - coord2[0])
-            q3 = np.cos(coord1[0] + coord2[0])
-            return int(RRR * np.arccos(0.5 * ((1.0 + q1) * q2 - (1.0 - q1) * q3)) + 1.0)
-
-        def transform_coord(coord):
-            deg = int(coord)
-            min_ = coord - deg
-            return np.pi * (deg + 5.0 * min_ / 3.0) / 180.0
-
-        for i in range(n):
-            coords[i, 0] = transform_coord(coords[i, 0])
-            coords[i, 1] = transform_coord(coords[i, 1])
-
-        dist_matrix = np.zeros((n, n))
-        for i in range(n):
-            for j in range(i + 1, n):
-                dist_matrix[i, j] = geo_distance(coords[i, :], coords[j, :])
-                dist_matrix[j, i] = dist_matrix[i, j]
-        return dist_matrix
-
     with open(filepath, "r") as file:
         lines = file.readlines()
 
@@ -126,18 +197,19 @@ def read_tsp_file(filepath, is_opt=False):
             )
         else:
             raise ValueError("Edge weight format not supported")
+        dist_matrix = dist_matrix.astype(dtype)
         node_coord_loc = get_node_coord_section_loc(lines, "DISPLAY_DATA_SECTION")
-    elif edge_weight_type == "EUC_2D":
-        node_coord_loc = get_node_coord_section_loc(lines, "NODE_COORD_SECTION")
-    elif edge_weight_type == "GEO":
+    elif edge_weight_type in COORD_EDGE_WEIGHT_TYPES:
         node_coord_loc = get_node_coord_section_loc(lines, "NODE_COORD_SECTION")
     else:
         raise ValueError("Edge weight type not supported")
     coords = get_coords(lines[node_coord_loc + 1 : node_coord_loc + n + 1])
-    if edge_weight_type == "EUC_2D":
-        dist_matrix = get_dist_matrix_from_coords(coords)
-    elif edge_weight_type == "GEO":
-        dist_matrix = get_dist_matrix_from_geo_coords(coords)
+    if edge_weight_type in COORD_EDGE_WEIGHT_TYPES and lazy:
+        dist_matrix = CoordinateDistances(coords, edge_weight_type, dtype)
+    elif edge_weight_type in COORD_EDGE_WEIGHT_TYPES:
+        dist_matrix = get_dist_matrix_from_coords(
+            coords, edge_weight_type, dtype, chunk_size
+        )
 
     if is_opt:
         lines = open(filepath[:-3] + "opt.tour", "r").readlines()
@@ -150,6 +222,60 @@ def read_tsp_file(filepath, is_opt=False):
     return coords, dist_matrix, None
 
 
+def read_tsp_file_cached(
+    filepath,
+    is_opt=False,
+    dtype=np.float64,
+    chunk_size=None,
+    lazy=False,
+    cache_dir=None,
+):
+    # Parsed instances are stored as .npy files in a directory named after the
+    # instance and a digest of its source files (path, mtime, contents), and
+    # are memory-mapped read-only on later calls.
+    if cache_dir is None:
+        cache_dir = config.CACHE_DIR
+    filepath = Path(filepath).resolve()
+    sources = [filepath]
+    if is_opt:
+        sources.append(filepath.with_suffix(".opt.tour"))
+    digest = hashlib.sha1(f"{np.dtype(dtype).str}:{lazy}".encode())
+    for source in sources:
+        digest.update(f"{source}:{source.stat().st_mtime_ns}".encode())
+        digest.update(source.read_bytes())
+    entry = Path(cache_dir) / f"{filepath.stem}-{digest.hexdigest()[:16]}"
+
+    if not entry.exists():
+        coords, dist_matrix, optimal_solution = read_tsp_file(
+            str(filepath), is_opt, dtype, chunk_size, lazy
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written aside and renamed, so concurrent readers never see a partial entry
+        tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=cache_dir))
+        np.save(tmp / "coords.npy", coords)
+        if isinstance(dist_matrix, CoordinateDistances):
+            np.save(tmp / "edge_weight_type.npy", dist_matrix.edge_weight_type)
+        else:
+            np.save(tmp / "dist_matrix.npy", dist_matrix)
+        if optimal_solution is not None:
+            np.save(tmp / "optimal_solution.npy", optimal_solution)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp)
+
+    coords = np.load(entry / "coords.npy", mmap_mode="r")
+    if (entry / "edge_weight_type.npy").exists():
+        edge_weight_type = str(np.load(entry / "edge_weight_type.npy"))
+        dist_matrix = CoordinateDistances(coords, edge_weight_type, dtype)
+    else:
+        dist_matrix = np.load(entry / "dist_matrix.npy", mmap_mode="r")
+    optimal_solution = None
+    if (entry / "optimal_solution.npy").exists():
+        optimal_solution = np.load(entry / "optimal_solution.npy", mmap_mode="r")
+    return coords, dist_matrix, optimal_solution
+
+
 def plot_solution(p, title, coords, dist_matrix):
     route = p
     n = len(route)
@@ -202,24 +328,95 @@ def plot_solution(p, title, coords, dist_matrix):
     plt.show()
 
 
-def get_objective_function(dist_matrix):
-    def tsp_objective_function(permutations):
-        # Add 0 to the beginning of each permutaiton
-        # Required shape: (n_permutations, space_size)
-        permutations_with_0 = np.concatenate(
-            [np.zeros([permutations.shape[0], 1], dtype=np.int64), permutations], axis=1
-        )
-        return dist_matrix[
-            permutations_with_0, np.roll(permutations_with_0, -1, axis=1)
-        ].sum(axis=1)
-
-    return tsp_objective_function
-
-
-def get_tsp_problem(data_dir, problem_name):
-    coords, dist_matrix, optimal_solution = read_tsp_file(
+class TSPObjective:
+    # Tour lengths of a batch of permutations of cities 1..n-1; city 0 is
+    # prepended to every tour. Index and gather buffers are kept between calls
+    # and grow to the largest batch (or chunk) seen.
+    def __init__(self, dist_matrix, dtype=None, chunk_size=None):
+        self.dist_matrix = dist_matrix
+        self.n = dist_matrix.shape[0]
+        self.chunk_size = chunk_size
+        self.flat = None
+        if isinstance(dist_matrix, np.ndarray):
+            self.flat = np.ascontiguousarray(dist_matrix, dtype=dtype).ravel()
+            self.dtype = self.flat.dtype
+        else:
+            self.dtype = np.dtype(dtype or dist_matrix.dtype)
+        self._capacity = 0
+
+    def _allocate(self, m, permutation_dtype):
+        # The tour buffer has the dtype of the permutations, so int16/int32
+        # populations are copied without widening; edge indices stay int64
+        self._tours = np.zeros((m, self.n), dtype=permutation_dtype)
+        self._indices = np.empty((m, self.n), dtype=np.int64)
+        self._lengths = np.empty((m, self.n), dtype=self.dtype)
+        self._capacity = m
+
+    def __call__(self, permutations, out=None, offset=0):
+        # Required shape: (n_permutations, space_size). offset is added to
+        # every city while copying into the tour buffer, e.g. offset=1 for
+        # permutations of 0..n-2.
+        m = permutations.shape[0]
+        if out is None:
+            out = np.empty(m, dtype=np.float64)
+        chunk_size = self.chunk_size or max(m, 1)
+        for start in range(0, m, chunk_size):
+            stop = min(start + chunk_size, m)
+            self._evaluate(permutations[start:stop], out[start:stop], offset)
+        return out
+
+    def _evaluate(self, permutations, out, offset):
+        m = permutations.shape[0]
+        if m > self._capacity or permutations.dtype != self._tours.dtype:
+            self._allocate(max(m, self._capacity), permutations.dtype)
+        tours = self._tours[:m]
+        np.add(permutations, offset, out=tours[:, 1:])
+        lengths = self._lengths[:m]
+        if self.flat is None:
+            lengths[:, :-1] = self.dist_matrix[tours[:, :-1], tours[:, 1:]]
+            lengths[:, -1] = self.dist_matrix[tours[:, -1], tours[:, 0]]
+        else:
+            # Edge (a, b) is a * n + b in the raveled matrix; the closing edge
+            # goes back to city 0, so its index is just a * n.
+            indices = self._indices[:m]
+            np.multiply(tours, self.n, out=indices, dtype=np.int64)
+            indices[:, :-1] += tours[:, 1:]
+            np.take(self.flat, indices, out=lengths)
+        np.sum(lengths, axis=1, out=out)
+
+
+def get_objective_function(dist_matrix, dtype=None, chunk_size=None):
+    return TSPObjective(dist_matrix, dtype, chunk_size)
+
+
+def get_tour_length(objective_function, tour):
+    # Length of a full tour of cities 0..n-1, e.g. the optimal solution
+    # returned by get_tsp_problem, in the objective function convention
+    tour = np.roll(tour, -int(np.flatnonzero(tour == 0)[0]))
+    return objective_function(tour[1:].reshape(1, -1))[0]
+
+
+def get_tsp_problem(
+    data_dir,
+    problem_name,
+    dtype=np.float64,
+    chunk_size=None,
+    use_cache=True,
+    lazy=False,
+    n_neighbours=None,
+):
+    # lazy=True computes edge lengths from coordinates instead of storing the
+    # n x n matrix; n_neighbours additionally caches the k nearest neighbours
+    # as LocalSearch candidates
+    read = read_tsp_file_cached if use_cache else read_tsp_file
+    coords, dist_matrix, optimal_solution = read(
         f"{data_dir}/{problem_name}.tsp",
         os.path.exists(f"{data_dir}/{problem_name}.opt.tour"),
+        dtype,
+        chunk_size,
+        lazy,
     )
+    if isinstance(dist_matrix, CoordinateDistances) and n_neighbours is not None:
+        dist_matrix.cache_neighbours(n_neighbours, chunk_size)
     objective_function = get_objective_function(dist_matrix)
     return coords, dist_matrix, objective_function, optimal_solution
@@ -1,5 +1,22 @@
 import numpy as np
 
+from mallows.consensus import consensus_cost
+from mallows.metrics import InversionVectors
+from mallows.theta import PositionThetaSolver, ThetaSolver
+
+
+def permutation_dtype(n, dtype=None):
+    # Smallest of int16, int32 and int64 that holds the values 0..n, or the
+    # given dtype once it is checked to be large enough
+    if dtype is None:
+        for dtype in (np.int16, np.int32, np.int64):
+            if np.iinfo(dtype).max >= n:
+                break
+    dtype = np.dtype(dtype)
+    if dtype.kind not in "iu" or np.iinfo(dtype).max < n:
+        raise ValueError(f"Permutations of size {n} do not fit in {dtype}")
+    return dtype
+
 
 def estimate_mean(samples):
     samples = samples.copy() + 1
@@ -7,48 +24,141 @@ def estimate_mean(samples):
     return np.argsort(np.argsort(pi))
 
 
-def estimate_theta(samples, sigma_0):
-    def f(theta, V, n):
-        val = 0.0
-        val += (n - 1.0) / (np.exp(theta) - 1)
-        val -= np.sum(
-            (n - np.arange(1, n) + 1) / (np.exp(theta * (n - np.arange(1, n) + 1)) - 1)
-        )
-        val -= V
-        return val
-
-    def f_prime(theta, n):
-        val = 0.0
-        val -= (n - 1) * (np.exp(theta)) / (np.exp(theta) - 1) ** 2
-        val += np.sum(
-            (n - np.arange(1, n) + 1) ** 2.0
-            * (np.exp(theta * (n - np.arange(1, n) + 1)))
-            / (np.exp(theta * (n - np.arange(1, n) + 1)) - 1) ** 2.0
-        )
-        return val
-
-    def newton_raphson(f, f_prime, x_0=0.01, tol=1e-5, max_iter=1000):
-        x = x_0
-        for i in range(max_iter):
-            f_x = f(x)
-            x_new = x - f_x / f_prime(x)
-            if np.abs(x_new - x) < tol:
-                return x_new
-            x = x_new
-        print("Newton-Raphson did not converge")
-        return x
-
+def estimate_inversion_vector(samples, sigma_0, inversion_vectors=None):
+    if inversion_vectors is None:
+        inversion_vectors = InversionVectors(sigma_0.shape[-1])
     sigma_0_inv = np.argsort(sigma_0)
-    samples_sigma_0_inv = samples[:, sigma_0_inv]
-    V_hat = np.zeros(sigma_0.shape[-1] - 1)
-    for i in range(sigma_0.shape[-1] - 1):
-        V_hat[i] = (
-            np.sum(samples_sigma_0_inv[:, i + 1 :].T < samples_sigma_0_inv[:, i])
-            / samples.shape[-2]
-        )
+    return inversion_vectors.column_sums(samples[:, sigma_0_inv]) / samples.shape[0]
+
+
+def estimate_theta(
+    samples, sigma_0, inversion_vectors=None, theta_0=None, theta_solver=None
+):
+    if theta_solver is None:
+        theta_solver = ThetaSolver(sigma_0.shape[-1])
+    V_hat = estimate_inversion_vector(samples, sigma_0, inversion_vectors)
     V = np.sum(V_hat)
-    theta = newton_raphson(
-        lambda x: f(x, V, sigma_0.shape[-1]),
-        lambda x: f_prime(x, sigma_0.shape[-1]),
-    )
+    theta = theta_solver(V, theta_0)
     return theta
+
+
+def estimate_theta_vector(
+    samples, sigma_0, inversion_vectors=None, theta_0=None, theta_solver=None
+):
+    if theta_solver is None:
+        theta_solver = PositionThetaSolver(sigma_0.shape[-1])
+    V_hat = estimate_inversion_vector(samples, sigma_0, inversion_vectors)
+    return theta_solver(V_hat, theta_0)
+
+
+def row_keys(samples):
+    # One opaque, hashable and sortable key per row
+    samples = np.ascontiguousarray(samples)
+    void = np.dtype((np.void, samples.dtype.itemsize * samples.shape[1]))
+    return samples.view(void)[:, 0]
+
+
+def precedence_matrix(samples, weights=None, chunk_size=None):
+    # C[u, w] = (weighted) number of samples with samples[:, u] < samples[:, w]
+    # Rows sharing a weight are counted together with a uint8 reduction, which
+    # is much cheaper than a weighted int64 contraction.
+    m, n = samples.shape
+    if weights is None:
+        weights = np.ones(m, dtype=np.int64)
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // max(n * n, 1))
+    precedence = np.zeros((n, n), dtype=np.int64)
+    order = np.argsort(weights, kind="stable")
+    values, starts = np.unique(weights[order], return_index=True)
+    for value, start, stop in zip(values, starts, np.append(starts[1:], m)):
+        if value == 0:
+            continue
+        for chunk_start in range(start, stop, chunk_size):
+            chunk = samples[order[chunk_start : min(chunk_start + chunk_size, stop)]]
+            less = chunk[:, :, None] < chunk[:, None, :]
+            precedence += value * np.add.reduce(
+                less.view(np.uint8), axis=0, dtype=np.int32
+            )
+    return precedence
+
+
+class ConsensusStatistics:
+    # Sufficient statistics of a multiset of permutations: position sums (for
+    # the Borda mean) and the pairwise precedence matrix (for the inversion
+    # count with respect to any central permutation). update() only touches
+    # the rows that differ from the multiset held so far, or rebuilds from
+    # the distinct new rows when that is cheaper. Either way an update costs
+    # O(n^2) per touched row against O(n log n) per row for estimate_mean and
+    # estimate_theta, so it only pays off when consecutive selections share
+    # most of their rows, e.g. once theta is large and the population has
+    # many duplicates.
+    def __init__(self, n):
+        self.n = n
+        self.m = 0
+        self.position_sums = np.zeros(n, dtype=np.int64)
+        self.precedence = np.zeros((n, n), dtype=np.int64)
+        self.keys = np.empty(0, dtype=np.dtype((np.void, 8 * n)))
+        self.rows = np.empty((0, n), dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def add(self, samples, weights=None):
+        samples = np.asarray(samples, dtype=np.int64)
+        if weights is None:
+            weights = np.ones(samples.shape[0], dtype=np.int64)
+        self.m += weights.sum()
+        self.position_sums += weights @ samples
+        self.precedence += precedence_matrix(samples, weights)
+
+    def remove(self, samples, weights=None):
+        samples = np.asarray(samples, dtype=np.int64)
+        if weights is None:
+            weights = np.ones(samples.shape[0], dtype=np.int64)
+        self.add(samples, -weights)
+
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=np.int64)
+        keys, index, counts = np.unique(
+            row_keys(samples), return_index=True, return_counts=True
+        )
+        rows = np.concatenate([self.rows, samples[index]])
+        all_keys, first, inverse = np.unique(
+            np.concatenate([self.keys, keys]), return_index=True, return_inverse=True
+        )
+        old_counts = np.zeros(all_keys.shape[0], dtype=np.int64)
+        new_counts = np.zeros(all_keys.shape[0], dtype=np.int64)
+        old_counts[inverse[: self.keys.shape[0]]] = self.counts
+        new_counts[inverse[self.keys.shape[0] :]] = counts
+        all_rows = rows[first]
+        changed = new_counts != old_counts
+        if np.count_nonzero(changed) < keys.shape[0]:
+            self.add(all_rows[changed], new_counts[changed] - old_counts[changed])
+        else:
+            # Touching more rows than the new multiset holds: rebuild instead
+            self.m = 0
+            self.position_sums[:] = 0
+            self.precedence[:] = 0
+            self.add(samples[index], counts)
+        kept = new_counts > 0
+        self.keys = all_keys[kept]
+        self.rows = all_rows[kept]
+        self.counts = new_counts[kept]
+
+    def borda(self):
+        # Same as estimate_mean on the held samples
+        return np.argsort(np.argsort((self.position_sums + self.m) / self.m))
+
+    def mean_inversions(self, sigma_0):
+        return consensus_cost(self.precedence, sigma_0, self.m)
+
+    def mean_inversion_vector(self, sigma_0):
+        # Same as estimate_inversion_vector on the held samples
+        sigma_0_inv = np.argsort(sigma_0)
+        ordered = self.precedence[np.ix_(sigma_0_inv, sigma_0_inv)]
+        return np.tril(ordered, -1).sum(axis=0)[:-1] / self.m
+
+    def estimate(self, consensus_function=None):
+        # Central permutation and its mean inversion count; Borda by default
+        if consensus_function is not None:
+            return consensus_function(self.precedence, self.m)
+        sigma_0 = self.borda()
+        return sigma_0, self.mean_inversions(sigma_0)